@@ -0,0 +1,177 @@
+"""Benchmark of the merge and subtitle stages on synthetic chunk results.
+
+Builds verbose_json-like chunk results for 10 min, 2 h and 8 h of audio, with the overlaps
+transcribed twice with some noise, and reports the time and peak memory of each stage.
+
+    python -m benchmarks.bench_merge                 # compare with benchmarks/baseline.json
+    python -m benchmarks.bench_merge --save          # record the current figures as the baseline
+    python -m benchmarks.bench_merge --sizes 10min   # only some inputs
+
+Exits with status 1 when a stage is slower or uses more memory than its baseline by more
+than the tolerance, or when there is no baseline. The committed baseline was recorded on a
+development machine, hence the generous default tolerance: record your own with --save for
+tighter checks. Run from the backend directory, with the same environment as the app.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.merge_transcription import merge_transcriptions, find_longest_common_sequence
+from src.subtitles import render_subtitles
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+# Differences under these are noise whatever the tolerance, for stages taking a few microseconds
+MIN_DELTAS = {'seconds': 0.002, 'peak_bytes': 64 * 1024}
+
+SIZES = {
+    '10min': 10 * 60,
+    '2h': 2 * 3600,
+    '8h': 8 * 3600,
+}
+CHUNK_LENGTH = 600  # seconds
+OVERLAP = 10  # seconds
+PAUSE = 0.1  # seconds, mean pause between two words
+WORDS_PER_SEGMENT = 12
+VOCABULARY = ("the a to of and in that it is was for on you he be with as by at have are this not but had "
+              "his they from she which or we an there her were one do been all their has would will what "
+              "if can when so no said who more about up them some could him into its then two out time "
+              "like only my did other me your now over just may these new also people any after know "
+              "transcription meeting budget quarter client campaign agency review slide launch").split()
+
+
+# ********************************************* Synthetic inputs *********************************************
+def make_speech(duration, rng):
+    """Absolute (start, end, word) timestamps of a whole recording."""
+    words = []
+    time_cursor = 0.0
+    while time_cursor < duration:
+        length = rng.uniform(0.15, 0.6)
+        words.append((time_cursor, min(time_cursor + length, duration), rng.choice(VOCABULARY)))
+        time_cursor += length + rng.uniform(0.0, 2 * PAUSE)
+    return words
+
+def make_chunk_result(words, chunk_start, chunk_end, rng, noise):
+    """verbose_json-like result of a chunk, with noisy words and timestamps in the overlaps."""
+    chunk_words = []
+    for start, end, word in words:
+        if start < chunk_start or end > chunk_end:
+            continue
+        if noise and (start < chunk_start + OVERLAP or end > chunk_end - OVERLAP) and rng.random() < 0.1:
+            word = rng.choice(VOCABULARY)  # misheard at the edge of the chunk
+        jitter = rng.uniform(-0.05, 0.05) if noise else 0.0
+        chunk_words.append({'word': word, 'start': max(0.0, start - chunk_start + jitter), 'end': end - chunk_start + jitter})
+    segments = []
+    for index in range(0, len(chunk_words), WORDS_PER_SEGMENT):
+        segment_words = chunk_words[index:index + WORDS_PER_SEGMENT]
+        segments.append({
+            'id': len(segments),
+            'start': segment_words[0]['start'],
+            'end': segment_words[-1]['end'],
+            'text': ' ' + ' '.join(word['word'] for word in segment_words) + '.',
+        })
+    return SimpleNamespace(text=''.join(segment['text'] for segment in segments), segments=segments, words=chunk_words)
+
+def make_results(duration, seed=0, noise=True):
+    """(result, offset) tuples of a recording cut into overlapping chunks, as fed to merge_transcriptions."""
+    rng = random.Random(seed)
+    words = make_speech(duration, rng)
+    results = []
+    start = 0
+    while True:
+        end = min(start + CHUNK_LENGTH, duration)
+        results.append((make_chunk_result(words, start, end, rng, noise), int(start * 1000)))
+        if end >= duration:
+            return results
+        start += CHUNK_LENGTH - OVERLAP
+
+def make_seams(results):
+    """Texts on both sides of each seam, as aligned by find_longest_common_sequence."""
+    return [[left.segments[-1]['text'], right.segments[0]['text']]
+            for (left, _), (right, _) in zip(results, results[1:]) if left.segments and right.segments]
+
+
+# ********************************************* Measures *********************************************
+def measure(stage, prepare, repeat):
+    """Best time over repeat runs of stage(prepare()), and the peak memory of one run."""
+    best = float('inf')
+    for _ in range(repeat):
+        data = prepare()
+        start = time.perf_counter()
+        stage(data)
+        best = min(best, time.perf_counter() - start)
+    data = prepare()
+    tracemalloc.start()
+    stage(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': best, 'peak_bytes': peak}
+
+def run(sizes, repeat):
+    figures = {}
+    for size in sizes:
+        duration = SIZES[size]
+        merged = merge_transcriptions(make_results(duration), strategy="words")
+        stages = {
+            'merge_text': (lambda: make_results(duration), lambda results: merge_transcriptions(results, strategy="text")),
+            'merge_words': (lambda: make_results(duration), lambda results: merge_transcriptions(results, strategy="words")),
+            'align_seams': (lambda: make_seams(make_results(duration)),
+                            lambda seams: [find_longest_common_sequence(seam) for seam in seams]),
+            'subtitles': (lambda: merged['segments'], lambda segments: render_subtitles(segments, ('srt', 'vtt', 'json'))),
+        }
+        for stage, (prepare, function) in stages.items():
+            name = f"{stage}[{size}]"
+            figures[name] = measure(function, prepare, repeat)
+            print(f"{name:<24} {figures[name]['seconds'] * 1000:10.2f} ms {figures[name]['peak_bytes'] / 1024 / 1024:10.2f} MB")
+    return figures
+
+def compare(figures, baseline, tolerance):
+    """Names of the stages regressing past the tolerance, with what regressed."""
+    regressions = []
+    for name, figure in figures.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        for measure_name in ('seconds', 'peak_bytes'):
+            if (figure[measure_name] > reference[measure_name] * (1 + tolerance)
+                    and figure[measure_name] - reference[measure_name] > MIN_DELTAS[measure_name]):
+                regressions.append(f"{name} {measure_name}: {figure[measure_name]:.4g} > {reference[measure_name]:.4g} (+{tolerance:.0%})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=list(SIZES))
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage, the best time is kept')
+    parser.add_argument('--tolerance', type=float, default=1.0, help='allowed regression, 1.0 for +100%%')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save', action='store_true', help='save the figures as the new baseline')
+    args = parser.parse_args()
+
+    figures = run(args.sizes, args.repeat)
+    if args.save:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        baseline.update(figures)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"FAIL no baseline at {args.baseline}, run with --save first")
+        return 1
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        regressions = compare(figures, json.load(f), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
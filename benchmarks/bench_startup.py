@@ -0,0 +1,69 @@
+"""Benchmark of the startup of the application: time to import it, measured with python -X importtime.
+
+    python -m benchmarks.bench_startup                 # import app, 2 s budget
+    python -m benchmarks.bench_startup --budget 1.5 --runs 5
+
+Imports the module in fresh interpreters, with the secrets cache of config.py warmed first,
+and reports the best wall time and the slowest imports. Exits with status 1 when the startup
+is over budget or when a module meant to be loaded lazily is imported at startup.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Heavy modules only loaded when first needed
+LAZY_MODULES = ('boto3', 'botocore', 'openai', 'groq', 'pydub', 'docx', 'requests')
+
+def import_once(module):
+    """Import module in a fresh interpreter, returns its wall time and the -X importtime report."""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                            cwd=BACKEND_DIR, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    return elapsed, result.stderr
+
+def parse_importtime(report):
+    """(cumulative microseconds, module) of each import of a -X importtime report."""
+    imports = []
+    for line in report.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        imports.append((int(cumulative), name))
+    return imports
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--module', default='app', help='module imported at startup')
+    parser.add_argument('--runs', type=int, default=3, help='imports measured, the best one is kept')
+    parser.add_argument('--budget', type=float, default=2.0, help='maximum startup time in seconds')
+    parser.add_argument('--top', type=int, default=15, help='slowest imports listed')
+    args = parser.parse_args()
+
+    import_once(args.module)  # warms the secrets cache and the bytecode
+    best, report = min((import_once(args.module) for _ in range(args.runs)), key=lambda run: run[0])
+    imports = parse_importtime(report)
+
+    print(f"Startup (import {args.module}): {best:.3f}s, budget {args.budget:.3f}s")
+    print(f"{'cumulative':>12}  module")
+    for cumulative, name in sorted(imports, reverse=True)[:args.top]:
+        print(f"{cumulative / 1000:10.1f}ms  {name}")
+
+    failed = False
+    eager = sorted({name.strip() for _, name in imports if name.strip().split('.')[0] in LAZY_MODULES})
+    if eager:
+        print(f"FAIL modules meant to be lazy imported at startup: {', '.join(eager)}")
+        failed = True
+    if best > args.budget:
+        print(f"FAIL startup over budget by {best - args.budget:.3f}s")
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,14 +1,25 @@
 import os
+import stat
 import tempfile
-import boto3
 import logging
 import json
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+# Secrets are cached in a local file so restarts (new workers, debug reloader) do not wait for AWS.
+# Set through environment variables since the secrets are not loaded yet.
+# Kept in a private directory of the user, never in the shared temp directory.
+SECRETS_CACHE_FILE = os.environ.get('SECRETS_CACHE_FILE', os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'mcc-transcript', 'secrets.json'))
+SECRETS_CACHE_TTL = int(os.environ.get('SECRETS_CACHE_TTL', 3600)) # seconds before a background refresh, 0 disables the cache
+SECRETS_CACHE_MAX_AGE = int(os.environ.get('SECRETS_CACHE_MAX_AGE', 24 * 3600)) # seconds after which the cache is not used at all
+
 def get_secrets():
     secret_name = "mcc-transcript"
     region_name = "eu-west-3"
+    import boto3  # slow to import, not needed when the secrets are cached
     session = boto3.session.Session()
     client = session.client(
         service_name='secretsmanager',
@@ -23,10 +34,71 @@ def get_secrets():
     except Exception as e:  
         logger.error(f"Error retrieving secret {secret_name}: {e}")
         raise e
+
+def save_secrets_cache(secrets, cache_file = SECRETS_CACHE_FILE):
+    """Write the secrets to the cache file, in a directory and a file of the current user only."""
+    temp_path = None
+    try:
+        cache_dir = os.path.dirname(os.path.abspath(cache_file))
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, prefix='.secrets-', suffix='.tmp')  # 0600, never an existing file
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(secrets)
+        os.replace(temp_path, cache_file)
+    except OSError as e:
+        logger.error(f"Cannot write secrets cache {cache_file}: {e}")
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def read_secrets_cache(cache_file = SECRETS_CACHE_FILE):
+    """Return the content of the cache file and its age in seconds, None if it cannot be trusted.
+
+    The file must be a regular file owned by the current user, private to it, and not
+    modified in the future, so a file planted by another user is never used as configuration.
+    """
+    try:
+        fd = os.open(cache_file, os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0))
+    except OSError:
+        return None
+    with os.fdopen(fd, 'r', encoding='utf-8') as f:
+        info = os.fstat(f.fileno())
+        age = time.time() - info.st_mtime
+        if not stat.S_ISREG(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077 or age < 0:
+            logger.warning(f"Ignoring untrusted secrets cache {cache_file}")
+            return None
+        return f.read(), age
+
+def refresh_secrets_cache(cache_file = SECRETS_CACHE_FILE):
+    """Fetch the secrets from AWS into the cache file, for the next start."""
+    try:
+        save_secrets_cache(get_secrets(), cache_file)
+    except Exception as e:
+        logger.error(f"Background refresh of the secrets cache failed: {e}")
+
+def load_secrets(cache_file = SECRETS_CACHE_FILE, ttl = SECRETS_CACHE_TTL, max_age = SECRETS_CACHE_MAX_AGE):
+    """Return the secrets, from the cache file when recent enough.
+
+    A cache older than ttl is still used, and refreshed in the background. Without a usable
+    cache, the secrets are fetched from AWS and cached.
+    """
+    if ttl > 0:
+        try:
+            secrets, age = read_secrets_cache(cache_file) or (None, None)
+            if secrets is not None and age <= max_age:
+                json.loads(secrets)  # do not trust a truncated file
+                if age > ttl:
+                    threading.Thread(target=refresh_secrets_cache, args=(cache_file,), daemon=True).start()
+                return secrets
+        except (OSError, ValueError):
+            pass
+    secrets = get_secrets()
+    if ttl > 0:
+        save_secrets_cache(secrets, cache_file)
+    return secrets
     
 
 # load env variable from aws secret manager
-secrets = get_secrets()
+secrets = load_secrets()
 secrets_dict = json.loads(secrets)
 
 class Config:
@@ -38,7 +110,6 @@ class Config:
     ALLOWED_EXTENSIONS={'mp3', 'mp4', 'mpeg', 'mpga', 'm4a', 'wav', 'webm'}
     SUPPORTED_LANGUAGES=["en", "de", "fr", "it", "pt", "hi", "es", "th"]
     MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # 50MB max file size
-    CLEANUP_INTERVAL = 24*60 # 1 day = 24*60 minutes
     AGE_LIMIT = 60 # age limit of files: 60 minutes
     
     # File system configuration
@@ -47,20 +118,73 @@ class Config:
         TMP_PATH = tempfile.gettempdir()
         VIDEO_FOLDER = os.path.join(TMP_PATH, 'videos')
         os.makedirs(VIDEO_FOLDER, exist_ok=True)   
+    FFMPEG_MAX_OUTPUTS_PER_PASS = 32 # chunks written by one ffmpeg process when splitting
+    # In memory only: decode with one streaming ffmpeg process (plus one per chunk to encode it) instead of pydub
+    STREAMING_AUDIO_PIPELINE = secrets_dict.get('STREAMING_AUDIO_PIPELINE', "true")
+    # Feed the S3 object to ffmpeg as it downloads instead of reading or saving it first
+    STREAM_FROM_S3 = secrets_dict.get('STREAM_FROM_S3', "true")
+        
+    #    ******************* Background jobs configuration *******************
+    JOB_WORKERS = int(secrets_dict.get('JOB_WORKERS', 2)) # transcriptions running at the same time
+    JOB_QUEUE_SIZE = int(secrets_dict.get('JOB_QUEUE_SIZE', 20)) # transcriptions waiting for a worker
+    JOB_RETENTION = 3600 # seconds a finished job stays queryable
+    JOB_MAX_ATTEMPTS = int(secrets_dict.get('JOB_MAX_ATTEMPTS', 2)) # a failed job is retried, resuming from its chunk journal
+    JOB_RETRY_DELAY = 10 # seconds before retrying a failed job
+    CHUNK_JOURNAL_BACKEND = secrets_dict.get('CHUNK_JOURNAL_BACKEND', "s3") # s3 (survives task restarts), disk or none
+    CHUNK_JOURNAL_DIR = os.path.join(tempfile.gettempdir(), 'chunk_journal')
+    CHUNK_JOURNAL_TTL = 24 * 3600 # seconds an abandoned journal is kept
+    SSE_KEEPALIVE_INTERVAL = 15 # seconds between keep-alive comments on idle progress streams
+    SSE_MAX_DURATION = 60 # seconds a progress stream stays open (and holds a server thread), the EventSource then reconnects
+    FETCH_MAX_WAIT = 20 # longest wait of /api/fetch for a result, each waiting fetch holds a server thread (see WEB_THREADS)
+    JOB_STATUS_POLL_INTERVAL = 0.5 # seconds between two reads of the status of a job run by another worker
+        
+    # Job statuses and results, "memory" for a single worker, "sqlite" or "redis" to share them between workers and tasks
+    RESULT_STORE_BACKEND = secrets_dict.get('RESULT_STORE_BACKEND', "memory")
+    RESULT_STORE_PATH = secrets_dict.get('RESULT_STORE_PATH', os.path.join(tempfile.gettempdir(), 'results.sqlite3'))
+    RESULT_STORE_REDIS_URL = secrets_dict.get('RESULT_STORE_REDIS_URL', "redis://localhost:6379/0")
+    RESULT_STORE_TTL = 3600 # seconds a job status or an unfetched result is kept
+    RESULT_STORE_CLEANUP_INTERVAL = 10 * 60 # seconds between two deletions of the expired entries
+    
+    #    ******************* Transcription cache configuration *******************
+    TRANSCRIPTION_CACHE_BACKEND = secrets_dict.get('TRANSCRIPTION_CACHE_BACKEND', "disk") # disk, s3 or none
+    TRANSCRIPTION_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'transcription_cache')
+    TRANSCRIPTION_CACHE_TTL = 7 * 24 * 3600 # 7 days
+    TRANSCRIPTION_CACHE_MAX_BYTES = 500 * 1024 * 1024 # 500MB
         
     #    ******************* Logging configuration *******************
     LOG_FOLDER = os.path.join(BASE_DIR, 'logs')
     os.makedirs(LOG_FOLDER, exist_ok=True)
     LOG_FILE = os.path.join(LOG_FOLDER, 'transcript.log')
     LOG_LEVEL = "INFO"
-    LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(job_id)s] %(message)s' # job_id is '-' outside of jobs
     LOG_MAX_BYTES = 10485760  # 10MB
     LOG_BACKUP_COUNT = 3
+    LOG_ROTATE_INTERVAL = 60 # seconds between two size checks of the log file shared by the gunicorn workers
+    LOG_TAIL_LINES = 200 # records shown by /logs by default
+    LOG_TAIL_MAX_LINES = 5000 # records returned by /logs at most
+    LOG_TAIL_MAX_SCAN_BYTES = 4 * 1024 * 1024 # bytes of the log file read by /logs at most per request
+    LOG_FOLLOW_POLL_INTERVAL = 1 # seconds between two reads of the log file in follow mode
+    LOG_FOLLOW_MAX_DURATION = 60 # seconds a follow stream stays open (and holds a server thread), clients resume with Last-Event-ID
     
     
     #    ******************* Application API configuration *******************
     # API Flask key
     FLASK_SECRET_KEY = secrets_dict.get('FLASK_SECRET_KEY')
+    DEBUG = secrets_dict.get('DEBUG', "false")
+    
+    # Web server (gunicorn.conf.py)
+    WEB_PORT = 5001
+    # Progress is tracked in the memory of a worker, and so are jobs and results with the memory result store
+    WEB_WORKERS = int(secrets_dict.get('WEB_WORKERS', 1))
+    # Requests served at the same time by a worker. Thread budget: each browser session holds up to
+    # 2 threads for long, its progress stream for SSE_MAX_DURATION at a time and /api/fetch?wait for FETCH_MAX_WAIT,
+    # and each /logs?follow=true one for LOG_FOLLOW_MAX_DURATION. 32 threads serve ~12 sessions and
+    # a log follower while leaving threads to the health probes, so ECS does not kill a busy task.
+    WEB_THREADS = int(secrets_dict.get('WEB_THREADS', 32))
+    WEB_TIMEOUT = 120 # seconds before a silent worker is restarted
+    # Held by the one worker that runs the periodic tasks (S3 sweep, result store cleanup, log rotation)
+    SCHEDULER_LOCK_FILE = os.path.join(tempfile.gettempdir(), 'mcc-transcript-scheduler.lock')
+    SHUTDOWN_DRAIN_TIMEOUT = int(secrets_dict.get('SHUTDOWN_DRAIN_TIMEOUT', 110)) # seconds left to running jobs on SIGTERM, the ECS stopTimeout must be 120 (see gunicorn.conf.py)
     
     # AWS
     AWS_ACCESS_KEY_ID = secrets_dict.get('aws_access_key_id')
@@ -69,6 +193,14 @@ class Config:
     AWS_REGION=secrets_dict.get('region')
     S3_UPLOAD_DIR = "uploads/"
     S3_TRANSCRIPT_DIR = "transcripts/"
+    S3_CACHE_DIR = "cache/" # transcription cache, with its own expiry
+    S3_JOURNAL_DIR = "journal/" # chunk results of running jobs, expired after CHUNK_JOURNAL_TTL
+    S3_SWEEP_INTERVAL = 60 * 60 # seconds between two deletions of the expired files
+    S3_MAX_POOL_CONNECTIONS = int(secrets_dict.get('S3_MAX_POOL_CONNECTIONS', 20)) # connections kept open by the shared client
+    S3_RETRY_MODE = "standard"
+    S3_MAX_ATTEMPTS = 5
+    S3_CONNECT_TIMEOUT = 5 # seconds
+    S3_READ_TIMEOUT = 60 # seconds
     
     # Frontend IP configuration
     IS_DOCKER = secrets_dict.get('IS_DOCKER', False)
@@ -103,38 +235,26 @@ class Config:
     GROQ_TEMPERATURE=0.0
     GROQ_RESPONSE_FORMAT="verbose_json"
     GROQ_OVERLAP_TIME=10 # seconds
-
-def read_log_file():
-    log_file_path = Config.LOG_FILE
-    try:
-        with open(log_file_path, 'r') as log_file:
-            formatted_logs = []
-            for line in log_file:
-                # Extract and colorize parts of the log line
-                parts = line.split(' - ')
-                if len(parts) >= 4:
-                    timestamp = f'<span style="color: cyan;">{parts[0]}</span>'
-                    logger_name = f'<span style="color: lightblue;">{parts[1]}</span>'
-                    level = parts[2]
-                    message = ' - '.join(parts[3:]).strip()
-
-                    if "ERROR" in level:
-                        level = f'<span style="color: red;">{level}</span>'
-                        message = f'<span style="color: red;">{message}</span>'
-                    elif "INFO" in level:
-                        level = f'<span style="color: green;">{level}</span>'
-                        message = f'<span style="color: green;">{message}</span>'
-                    elif "WARNING" in level:
-                        level = f'<span style="color: yellow;">{level}</span>'
-                        message = f'<span style="color: yellow;">{message}</span>'
-
-                    formatted_logs.append(f"{timestamp} - {logger_name} - {level} - {message}")
-                else:
-                    formatted_logs.append(line.strip())  # Fallback for unexpected formats
-
-            return '<br>'.join(formatted_logs)  # Use <br> for HTML line breaks
-    except Exception as e:
-        logger.error(f"Error reading log file {log_file_path}: {e}")
-        return f"Error reading log file: {e}"
-
-
+    # Merge of the chunks: "text" aligns the texts, "words" (opt-in, requests word timestamps from the provider)
+    # drops the words said twice in overlaps by their timestamps
+    MERGE_STRATEGY=secrets_dict.get('MERGE_STRATEGY', "text")
+    # Subtitle files saved with each transcription, among srt, vtt and json
+    SUBTITLE_FORMATS=[f.strip() for f in secrets_dict.get('SUBTITLE_FORMATS', "srt,vtt,json").split(',') if f.strip()]
+    # Silence-aware chunking: cut chunks in the quietest point before their target length
+    SILENCE_AWARE_CHUNKING=secrets_dict.get('SILENCE_AWARE_CHUNKING', "true")
+    SILENCE_SEARCH_WINDOW=30 # seconds before the target chunk end searched for a silence
+    SILENCE_MIN_DURATION=0.3 # seconds, length of the quiet window looked for
+    SILENCE_CHUNK_OVERLAP=0 # seconds of overlap between chunks cut in a silence
+    # Chunk planning: chunks are sized from the upload limit and the measured bitrate of the audio
+    GROQ_MAX_UPLOAD_BYTES=int(secrets_dict.get('GROQ_MAX_UPLOAD_BYTES', 25 * 1024 * 1024)) # 25MB on the free tier
+    CHUNK_SIZE_MARGIN=0.9 # fraction of the upload limit actually used, room for the multipart envelope
+    CHUNK_MIN_LENGTH=60 # seconds
+    CHUNK_MAX_LENGTH=1800 # seconds
+    CHUNK_BUFFER_BUDGET_BYTES=512 * 1024 * 1024 # encoded chunks buffered for the requests in flight
+    GROQ_MAX_CONCURRENT_REQUESTS=int(secrets_dict.get('GROQ_MAX_CONCURRENT_REQUESTS', 4)) # max chunks in flight at the same time
+    # Groq rate limits, kept in sync with the x-ratelimit-* response headers
+    GROQ_REQUESTS_PER_MINUTE=float(secrets_dict.get('GROQ_REQUESTS_PER_MINUTE', 20))
+    GROQ_AUDIO_SECONDS_PER_HOUR=float(secrets_dict.get('GROQ_AUDIO_SECONDS_PER_HOUR', 7200))
+    GROQ_MAX_RETRIES=5 # retries of a chunk after a 429 or a server error
+    GROQ_RETRY_BASE_DELAY=1.0 # seconds, doubled on each retry
+    GROQ_RETRY_MAX_DELAY=60.0 # seconds
@@ -0,0 +1,46 @@
+# Gunicorn configuration of the production server: gunicorn -c gunicorn.conf.py wsgi:app
+import signal
+import threading
+import time
+from config import Config
+
+bind = f"0.0.0.0:{Config.WEB_PORT}"
+worker_class = "gthread"
+workers = Config.WEB_WORKERS
+threads = Config.WEB_THREADS
+timeout = Config.WEB_TIMEOUT
+# On SIGTERM, workers stop accepting requests and finish their transcriptions (see post_worker_init).
+# The ECS stopTimeout of the container must be above it (120), its default of 30s kills running jobs.
+graceful_timeout = Config.SHUTDOWN_DRAIN_TIMEOUT + 5
+accesslog = "-"
+errorlog = "-"
+
+def child_exit(server, worker):
+    """Drop the live gauges of a dead worker from the metrics shared with PROMETHEUS_MULTIPROC_DIR."""
+    from src.metrics import MULTIPROCESS
+    if MULTIPROCESS:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+def post_worker_init(worker):
+    """Start draining the transcriptions as soon as the worker receives SIGTERM.
+
+    Gunicorn only calls worker_exit once the requests in flight (progress streams included) are
+    done or graceful_timeout is over, so the drain runs next to that wait instead of after it.
+    """
+    handle_exit = worker.handle_exit
+
+    def drain_on_exit(sig, frame):
+        from src.jobs import job_manager
+        worker.drain_deadline = time.monotonic() + Config.SHUTDOWN_DRAIN_TIMEOUT
+        threading.Thread(target=job_manager.drain, args=(Config.SHUTDOWN_DRAIN_TIMEOUT,), daemon=True).start()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, drain_on_exit)
+
+def worker_exit(server, worker):
+    """Let the queued and running transcriptions of the worker finish, in what is left of the drain, before it exits."""
+    from src.jobs import job_manager
+    deadline = getattr(worker, 'drain_deadline', time.monotonic() + Config.SHUTDOWN_DRAIN_TIMEOUT)
+    if not job_manager.drain(max(0, deadline - time.monotonic())):
+        server.log.warning(f"Worker {worker.pid} exiting with unfinished transcriptions")
@@ -1,11 +1,19 @@
 import sys
+import signal
 from src.file_utils import *
 from config import Config
 from src.initiate import initialize_app
 from app import app
 from src.logger import setup_logger
+from src.scheduler import acquire_leadership
 
 
+def drain_and_exit(signum, frame):
+    """Stop accepting transcriptions and wait for the running ones before exiting."""
+    from src.jobs import job_manager
+    job_manager.drain(Config.SHUTDOWN_DRAIN_TIMEOUT)
+    sys.exit(0)
+
 def main():
     try:
         
@@ -18,12 +26,15 @@ def main():
         # Configure logging
         logger = setup_logger()
         
-        # launch cleanup thread
-        schedule_cleanup()
+        # launch cleanup thread, once with the debug reloader
+        schedule_cleanup(acquire_leadership())
         logger.info("Starting Flask application")
         
-        # Launching app 
-        app.run(host='0.0.0.0', debug=True, port=5001)
+        # Let running transcriptions finish when the container is stopped
+        signal.signal(signal.SIGTERM, drain_and_exit)
+        
+        # Launching app (development server, see wsgi.py for production)
+        app.run(host='0.0.0.0', debug=Config.DEBUG == "true", port=Config.WEB_PORT)
 
     except Exception as e:
         print(f"Error starting Flask app: {e}")
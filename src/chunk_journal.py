@@ -0,0 +1,188 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from types import SimpleNamespace
+from config import Config
+from src.s3Bucket import get_s3_client
+
+logger = logging.getLogger(__name__)
+
+# ********************************************* Results *********************************************
+def chunk_result_to_dict(result):
+    """Convert a verbose_json transcription result to a JSON-serializable dict."""
+    if isinstance(result, dict):
+        return result
+    if hasattr(result, 'model_dump'):
+        return result.model_dump()
+    return {'text': getattr(result, 'text', ''), 'segments': getattr(result, 'segments', [])}
+
+def chunk_result_from_dict(data):
+    """Rebuild a transcription result usable by merge_transcriptions from its journal entry."""
+    return SimpleNamespace(**data)
+
+def make_journal_key(fingerprint, language, chunking, model = Config.GROQ_MODEL, merge_strategy = Config.MERGE_STRATEGY):
+    """Key of the journal of a job, stable across retries and task restarts.
+
+    Args:
+        fingerprint (str): fingerprint of the uploaded S3 object.
+        language (str): language requested for the transcription.
+        chunking (str): signature of the chunking parameters, which define the chunk offsets.
+        model (str): transcription model.
+        merge_strategy (str): how the chunks are merged, which defines what the results contain.
+    """
+    key = f"{fingerprint}|{language}|{chunking}|{model}|{merge_strategy}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def _job_tag(job_id):
+    """Short tag of a job id in the entry names, the id itself may contain any character."""
+    return hashlib.sha256(job_id.encode('utf-8')).hexdigest()[:16]
+
+def _entry_name(index, offset, tag):
+    return f"chunk_{index:05d}_{offset}_{tag}.json"
+
+def _parse_entry_name(name):
+    """Return (index, offset, tag) of an entry name, None if it is not a chunk entry."""
+    if not (name.startswith('chunk_') and name.endswith('.json')):
+        return None
+    try:
+        _, index, offset, tag = name[:-len('.json')].split('_')
+        return int(index), int(offset), tag
+    except ValueError:
+        return None
+
+def _written_by(name, tag):
+    parsed = _parse_entry_name(name)
+    return parsed is not None and parsed[2] == tag
+
+# ********************************************* Journals *********************************************
+# Jobs on the same upload share a journal and resume from each other's entries, but each job
+# only clears the entries it wrote, which another job running at the same time may still need.
+class LocalDiskJournal:
+    """Journal of the chunk results of a job, one JSON file per chunk in a local directory."""
+
+    def __init__(self, job_key, job_id, directory = Config.CHUNK_JOURNAL_DIR, ttl = Config.CHUNK_JOURNAL_TTL, logger = logger):
+        self.job_key = job_key
+        self.tag = _job_tag(job_id)
+        self.directory = os.path.join(directory, job_key)
+        self.logger = logger
+        self._cleanup_stale(directory, ttl)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _cleanup_stale(self, directory, ttl):
+        """Delete journals of jobs abandoned for more than ttl seconds."""
+        if not os.path.isdir(directory):
+            return
+        now = time.time()
+        for entry in os.scandir(directory):
+            try:
+                if entry.is_dir() and now - entry.stat().st_mtime > ttl:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            except FileNotFoundError:
+                continue
+
+    def load(self):
+        """Return the journaled results by chunk index, as {index: (result, offset)}."""
+        entries = {}
+        for name in os.listdir(self.directory):
+            parsed = _parse_entry_name(name)
+            if parsed is None:
+                continue
+            try:
+                with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as f:
+                    entries[parsed[0]] = (chunk_result_from_dict(json.load(f)), parsed[1])
+            except Exception as e:
+                self.logger.error(f"Ignoring unreadable journal entry {name}: {e}")
+        return entries
+
+    def record(self, index, offset, result):
+        os.makedirs(self.directory, exist_ok=True)  # removed if another job cleared the journal in the meantime
+        path = os.path.join(self.directory, _entry_name(index, offset, self.tag))
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(chunk_result_to_dict(result), f, default=str)
+        os.replace(temp_path, path)
+
+    def clear(self):
+        """Delete the entries written by this job, and the journal once no other job has entries left."""
+        try:
+            for name in os.listdir(self.directory):
+                if _written_by(name, self.tag):
+                    os.remove(os.path.join(self.directory, name))
+            os.rmdir(self.directory)
+        except OSError:
+            pass  # already removed, or entries of another job left
+
+
+class S3Journal:
+    """Journal of the chunk results of a job, one JSON object per chunk under a prefix of the S3 bucket.
+
+    Survives the restart of the ECS task. Abandoned journals are expired by the S3 cleanup.
+    """
+
+    def __init__(self, job_key, job_id, prefix = Config.S3_JOURNAL_DIR, logger = logger):
+        self.job_key = job_key
+        self.tag = _job_tag(job_id)
+        self.prefix = f"{prefix}{job_key}/"
+        self.logger = logger
+
+    def _list_keys(self):
+        s3_client = get_s3_client(self.logger)
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=Config.BUCKET_NAME, Prefix=self.prefix):
+            for object in page.get('Contents', []):
+                yield object['Key']
+
+    def load(self):
+        """Return the journaled results by chunk index, as {index: (result, offset)}."""
+        s3_client = get_s3_client(self.logger)
+        entries = {}
+        for key in self._list_keys():
+            parsed = _parse_entry_name(key[len(self.prefix):])
+            if parsed is None:
+                continue
+            try:
+                object = s3_client.get_object(Bucket=Config.BUCKET_NAME, Key=key)
+                entries[parsed[0]] = (chunk_result_from_dict(json.loads(object['Body'].read())), parsed[1])
+            except Exception as e:
+                self.logger.error(f"Ignoring unreadable journal entry {key}: {e}")
+        return entries
+
+    def record(self, index, offset, result):
+        get_s3_client(self.logger).put_object(
+            Bucket=Config.BUCKET_NAME,
+            Key=f"{self.prefix}{_entry_name(index, offset, self.tag)}",
+            Body=json.dumps(chunk_result_to_dict(result), default=str).encode('utf-8'),
+            ContentType='application/json'
+        )
+
+    def clear(self):
+        """Delete the entries written by this job."""
+        keys = [key for key in self._list_keys() if _written_by(key[len(self.prefix):], self.tag)]
+        s3_client = get_s3_client(self.logger)
+        for start in range(0, len(keys), 1000):
+            s3_client.delete_objects(
+                Bucket=Config.BUCKET_NAME,
+                Delete={'Objects': [{'Key': key} for key in keys[start:start + 1000]], 'Quiet': True}
+            )
+
+
+def open_chunk_journal(job_key, job_id, backend = Config.CHUNK_JOURNAL_BACKEND, logger = logger):
+    """Return the journal of a job for the configured backend, None when journaling is disabled.
+
+    Args:
+        job_key (str): key of the journal, see make_journal_key.
+        job_id (str): id of the job, whose entries are the ones cleared at the end.
+    """
+    try:
+        if backend == "s3":
+            return S3Journal(job_key, job_id, logger=logger)
+        if backend == "disk":
+            return LocalDiskJournal(job_key, job_id, logger=logger)
+        if backend != "none":
+            logger.error(f"Unknown chunk journal backend: {backend}, journaling disabled")
+    except Exception as e:
+        logger.error(f"Cannot open chunk journal {job_key}, journaling disabled: {e}")
+    return None
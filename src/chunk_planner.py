@@ -0,0 +1,98 @@
+import math
+from config import Config
+from src.silence import plan_silence_boundaries
+
+# Chunks are cut inside silences when enabled, which needs little or no overlap between them
+if Config.SILENCE_AWARE_CHUNKING == "true":
+    CHUNK_OVERLAP = Config.SILENCE_CHUNK_OVERLAP
+    SILENCE_SEARCH_WINDOW = Config.SILENCE_SEARCH_WINDOW
+else:
+    CHUNK_OVERLAP = Config.GROQ_OVERLAP_TIME
+    SILENCE_SEARCH_WINDOW = None
+
+# Upper bound of the bitrate of 16kHz mono 16-bit audio, used until it is measured
+PCM_BYTES_PER_SECOND = 16000 * 2
+
+
+class ChunkPlan:
+    """Chunks of an audio file: their length and the offset table shared by the splitter and the merge.
+
+    Args:
+        chunk_length (float): target length of a chunk in seconds.
+        overlap (float): overlap between consecutive chunks in seconds.
+        boundaries (list): (start, end) times in seconds of each chunk.
+    """
+
+    def __init__(self, chunk_length, overlap, boundaries):
+        self.chunk_length = chunk_length
+        self.overlap = overlap
+        self.boundaries = boundaries
+        self.offsets = [int(round(start * 1000)) for start, _ in boundaries]
+
+    def __len__(self):
+        return len(self.boundaries)
+
+    def is_single_request(self):
+        return len(self.boundaries) == 1
+
+
+def max_chunk_length(bytes_per_second, concurrency = Config.GROQ_MAX_CONCURRENT_REQUESTS):
+    """Longest chunk in seconds whose encoded size fits the upload limit.
+
+    The chunks buffered for the requests in flight (one per worker plus the next one) must
+    also fit the buffer budget, so more concurrency means shorter chunks.
+    """
+    max_bytes = min(Config.GROQ_MAX_UPLOAD_BYTES * Config.CHUNK_SIZE_MARGIN,
+                    Config.CHUNK_BUFFER_BUDGET_BYTES / (max(1, concurrency) + 1))
+    length = max_bytes / max(bytes_per_second, 1)
+    return max(Config.CHUNK_MIN_LENGTH, min(Config.CHUNK_MAX_LENGTH, int(length)))
+
+def compute_chunk_boundaries(duration, chunk_length, overlap = CHUNK_OVERLAP):
+    """Return the (start, end) times in seconds of overlapping chunks covering duration.
+
+    Chunks start every chunk_length - overlap seconds and the last chunk ends at duration,
+    so no chunk is made only of audio already covered by the previous one.
+    """
+    boundaries = []
+    step = chunk_length - overlap
+    start = 0
+    while True:
+        end = min(start + chunk_length, duration)
+        boundaries.append((start, end))
+        if end >= duration:
+            return boundaries
+        start += step
+
+def plan_chunks(duration, audio_bytes = None, energies = None, concurrency = Config.GROQ_MAX_CONCURRENT_REQUESTS,
+                overlap = CHUNK_OVERLAP, search_window = SILENCE_SEARCH_WINDOW):
+    """Plan the fewest chunks of an audio file that fit the upload limit.
+
+    Args:
+        duration (float): duration of the audio in seconds.
+        audio_bytes (int): size of the encoded audio, to measure its bitrate. Unknown, the bitrate
+            of raw PCM is assumed.
+        energies (np.ndarray): energy profile of the audio, to cut the chunks inside silences.
+        concurrency (int): number of chunks transcribed at the same time.
+
+    Returns:
+        ChunkPlan: a single chunk when the whole audio fits in one request.
+    """
+    bytes_per_second = audio_bytes / duration if audio_bytes and duration else PCM_BYTES_PER_SECOND
+    max_length = max_chunk_length(bytes_per_second, concurrency)
+    if duration <= max_length:
+        return ChunkPlan(max_length, 0, [(0, duration)])
+
+    if search_window and energies is not None:
+        boundaries = plan_silence_boundaries(energies, duration, max_length, overlap, search_window)
+        return ChunkPlan(max_length, overlap, boundaries)
+
+    # Same number of chunks as with max_length, but evenly sized so the last one is not a tiny leftover
+    chunk_count = math.ceil((duration - overlap) / (max_length - overlap))
+    chunk_length = math.ceil((duration - overlap) / chunk_count + overlap)
+    return ChunkPlan(chunk_length, overlap, compute_chunk_boundaries(duration, chunk_length, overlap))
+
+def chunking_signature(concurrency = Config.GROQ_MAX_CONCURRENT_REQUESTS):
+    """Describe the chunk planning settings, chunks of two jobs line up only if their signatures match."""
+    return (f"{Config.GROQ_MAX_UPLOAD_BYTES}|{Config.CHUNK_SIZE_MARGIN}|{Config.CHUNK_MIN_LENGTH}|"
+            f"{Config.CHUNK_MAX_LENGTH}|{Config.CHUNK_BUFFER_BUDGET_BYTES}|{concurrency}|"
+            f"{CHUNK_OVERLAP}|{SILENCE_SEARCH_WINDOW}")
@@ -1,20 +1,29 @@
+import io
 import os
-import openai
-from groq import Groq
 import logging
 from config import Config
 import time
-import httpx
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from src.rate_limiter import rate_limit_scheduler
+from src.process_audio import get_flac_duration
+from src.subtitles import write_subtitles
+from src.jobs import current_job, job_context
+from src.metrics import (PROVIDER_REQUEST_SECONDS, PROVIDER_RATE_LIMITED, PROVIDER_RETRIES,
+                         PROVIDER_FAILURES, count_bytes)
 
 logger = logging.getLogger(__name__)
 
 # initialize client
 def initialize_client(logger = logger):
+    # The SDKs are only loaded when a transcription needs them
     if Config.CLIENT_CHOICE == '1':
+        import openai
         client = openai.OpenAI(api_key = Config.OPENAI_API_KEY)
         logger.info("OpenAI client initialized")
     elif Config.CLIENT_CHOICE == '2':
-        client = Groq(api_key= Config.GROQ_API_KEY)
+        from groq import Groq
+        # Retries are handled by the shared rate limit scheduler
+        client = Groq(api_key= Config.GROQ_API_KEY, max_retries=0)
         logger.info("Groq client initialized")
     return client
 
@@ -74,72 +83,197 @@ def transcribe_groq(audio_path, client, language="no_language", translation_lang
     srt = GenerateSRTFromGroq(transcription.segments, logger)
     return transcription.text, srt
 
-def Transcribe_WithGroq_SingleChunk(client, chunk, chunk_num, total_chunks, language = 'en'):
-    """Transcribe a single audio chunk with Groq API."""
+def Transcribe_WithGroq_SingleChunk(client, chunk, chunk_num, total_chunks, language = 'en', audio_seconds = None,
+                                    scheduler = rate_limit_scheduler):
+    """Transcribe a single audio chunk with Groq API.
+
+    Send slots are handed out by the shared rate limit scheduler, which is kept in sync with the
+    x-ratelimit-* headers of each response. Rate limited (429), server errors, and requests that
+    got no response (connection error or timeout) are retried with a jittered backoff, up to
+    scheduler.max_retries times.
+    """
     total_api_time = 0
+    transcription_params = {
+        "file": ("chunk.flac", chunk, "audio/flac"),
+        "model": Config.GROQ_MODEL,
+        "response_format": "verbose_json",
+        "temperature": Config.GROQ_TEMPERATURE,
+    }
+    if language != "do not know" and language != "none of the above":
+        transcription_params["language"] = language
+    if Config.MERGE_STRATEGY == "words":
+        # Word timestamps let the merge drop the words said twice in overlaps
+        transcription_params["timestamp_granularities"] = ["word", "segment"]
+    if audio_seconds is None:
+        audio_seconds = get_flac_duration(chunk) or 0
     
+    attempt = 0
     while True:
+        scheduler.acquire(audio_seconds)
+        if hasattr(chunk, 'seek'):
+            chunk.seek(0)  # a previous attempt may have consumed the chunk
+        count_bytes('provider_upload', chunk)
         start_time = time.time()
         try:
-            if language == "do not know" or language == "none of the above":
-                result = client.audio.transcriptions.create(
-                file=("chunk.flac", chunk, "audio/flac"),
-                model="whisper-large-v3",
-                response_format="verbose_json",
-                temperature=Config.GROQ_TEMPERATURE
-                )
-            else:
-                result = client.audio.transcriptions.create(
-                    file=("chunk.flac", chunk, "audio/flac"),
-                    model="whisper-large-v3",
-                    language=language,
-                    response_format="verbose_json",
-                    temperature=Config.GROQ_TEMPERATURE
-                    )
-            api_time = time.time() - start_time
-            total_api_time += api_time
-            return result, total_api_time
-        except httpx.HTTPStatusError as e:
-            if e.response.status_code == 429:
-                # If rate limited error, wait for 60 seconds and try again
-                time.sleep(60)
-                continue
-            else:
-                raise RuntimeError(f"Error transcribing chunk {chunk_num}: {str(e)}")
+            response = client.audio.transcriptions.with_raw_response.create(**transcription_params)
+            total_api_time += time.time() - start_time
+            PROVIDER_REQUEST_SECONDS.observe(time.time() - start_time)
+            scheduler.update_from_headers(response.headers)
+            return response.parse(), total_api_time
         except Exception as e:
-            raise RuntimeError(f"Error transcribing chunk {chunk_num}: {str(e)}")
+            total_api_time += time.time() - start_time
+            PROVIDER_REQUEST_SECONDS.observe(time.time() - start_time)
+            status_code, headers = _get_error_status(e)
+            if status_code == 429:
+                PROVIDER_RATE_LIMITED.inc()
+            connection_error = status_code is None and _is_connection_error(e)
+            retryable = status_code == 429 or (status_code is not None and status_code >= 500) or connection_error
+            if not retryable or attempt >= scheduler.max_retries:
+                PROVIDER_FAILURES.inc()
+                raise RuntimeError(f"Error transcribing chunk {chunk_num}: {str(e)}")
+            if status_code == 429:
+                delay = scheduler.on_rate_limited(headers, attempt)
+                PROVIDER_RETRIES.labels(reason='rate_limited').inc()
+            elif connection_error:
+                delay = scheduler.backoff_delay(attempt)
+                PROVIDER_RETRIES.labels(reason='connection_error').inc()
+                logger.warning(f"No response for chunk {chunk_num} ({type(e).__name__}: {e}), retrying in {delay:.2f}s")
+            else:
+                delay = scheduler.backoff_delay(attempt)
+                PROVIDER_RETRIES.labels(reason='server_error').inc()
+                logger.warning(f"Server error {status_code} on chunk {chunk_num}, retrying in {delay:.2f}s")
+            attempt += 1
+            time.sleep(delay)
+
+def _get_error_status(error):
+    """Return the HTTP status code and headers of a provider error, (None, None) if it has none."""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None, None
+    return getattr(response, 'status_code', None), getattr(response, 'headers', None)
+
+# Raised by the groq and openai SDKs when a request got no response, APITimeoutError included.
+# Matched by name since the SDKs are imported lazily.
+CONNECTION_ERROR_NAMES = {'APIConnectionError'}
+
+def _is_connection_error(error):
+    """Return True if the error is a failed connection or a timeout, not an answer of the provider."""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    return any(error_class.__name__ in CONNECTION_ERROR_NAMES for error_class in type(error).__mro__)
+
+def Transcribe_Chunks_Concurrently(client, chunks, language = 'en', max_workers = Config.GROQ_MAX_CONCURRENT_REQUESTS,
+                                   progress_callback = None, journal = None, logger = logger):
+    """Transcribe audio chunks with a bounded pool of concurrent Groq requests.
+
+    Chunks are pulled from the iterable only when a worker is about to be free, so a
+    generator that decodes audio on the fly keeps running alongside the transcription
+    without buffering more than a few chunks.
+
+    Args:
+        client: Groq client shared by the worker threads.
+        chunks (iterable): (chunk, offset) pairs, where chunk is an in-memory chunk (file-like object)
+            or the path of a temporary chunk file, and offset its start in milliseconds.
+            Chunk files are deleted once transcribed.
+        language (str): language of the audio.
+        max_workers (int): maximum number of requests in flight at the same time.
+        progress_callback (callable): called with (completed_chunks, total_chunks) after each chunk,
+            total_chunks is None while chunks are still being produced.
+        journal (ChunkJournal): journal of the job. Chunks already in it are not sent again,
+            and each new result is recorded as soon as it is received.
+
+    Returns:
+        list: (result, offset) tuples in chunk order, as expected by merge_transcriptions.
+        float: total API time summed over all chunks.
+    """
+    total_chunks = len(chunks) if hasattr(chunks, '__len__') else None
+    max_workers = max(1, max_workers)
+    max_pending = max_workers + 1  # one chunk ready for the next free worker
+    results = []
+    total_api_time = 0
+    job = current_job()  # logs of the pool threads are tagged with the job
+
+    def transcribe_one(index, chunk):
+        with job_context(job):
+            return transcribe_chunk(index, chunk)
+
+    def transcribe_chunk(index, chunk):
+        logger.info(f"Transcribing chunk {index + 1}" + (f" of {total_chunks}" if total_chunks else ""))
+        if isinstance(chunk, str):
+            # Open the temporary chunk file and clean it up once transcribed
+            try:
+                with open(chunk, 'rb') as chunk_file:
+                    return Transcribe_WithGroq_SingleChunk(client, chunk_file, index + 1, total_chunks, language)
+            finally:
+                os.remove(chunk)
+        return Transcribe_WithGroq_SingleChunk(client, chunk, index + 1, total_chunks, language)
+
+    journaled = journal.load() if journal else {}
+    if journaled:
+        logger.info(f"{len(journaled)} chunks already transcribed in the journal of the job")
+
+    iterator = iter(chunks)
+    futures = {}
+    pending = set()
+    exhausted = False
+    completed = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            while True:
+                while not exhausted and len(pending) < max_pending:
+                    try:
+                        chunk, offset = next(iterator)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    entry = journaled.get(len(results))
+                    if entry and entry[1] == offset:
+                        # Transcribed by a previous attempt of the job
+                        results.append(entry)
+                        completed += 1
+                        if isinstance(chunk, str):
+                            os.remove(chunk)
+                        continue
+                    future = executor.submit(transcribe_one, len(results), chunk)
+                    futures[future] = (len(results), chunk)
+                    results.append((None, offset))
+                    pending.add(future)
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, _ = futures[future]
+                    result, chunk_time = future.result()
+                    total_api_time += chunk_time
+                    results[index] = (result, results[index][1])
+                    completed += 1
+                    if journal:
+                        try:
+                            journal.record(index, results[index][1], result)
+                        except Exception as e:
+                            logger.error(f"Cannot record chunk {index + 1} in the journal: {e}")
+                    logger.info(f"Chunk {index + 1} transcribed in {chunk_time:.2f}s")
+                    if progress_callback:
+                        progress_callback(completed, len(results) if exhausted else total_chunks)
+        except Exception:
+            # Do not send the remaining chunks once one of them has failed
+            for future in pending:
+                _, chunk = futures[future]
+                if future.cancel() and isinstance(chunk, str) and os.path.exists(chunk):
+                    os.remove(chunk)
+            if hasattr(iterator, 'close'):
+                iterator.close()  # stops the decoder of a streamed source
+            elif total_chunks:
+                for chunk, _ in iterator:
+                    if isinstance(chunk, str) and os.path.exists(chunk):
+                        os.remove(chunk)
+            raise
+
+    return results, total_api_time
 
 def GenerateSRTFromGroq(segments, logger = logger):
     """Generate SRT file from Groq's transcriptions"""
     logger.info("Generating SRT file from Groq transcriptions")
-    srt = ''
-    
-    # harmonizers because of the chunks 
-    last_id = 0
-    last_end_time = 0.0
-    time_cursor = 0.0
-    id_cursor = 1
-    
-    for segment in segments:
-        # Harmonize the start_time, end_time, and id if they go back to 0
-        if segment['id'] == 0 and segment['start'] == 0:
-            id_cursor += last_id
-            time_cursor += last_end_time
-        
-        start_time = segment['start'] + time_cursor
-        end_time = segment['end'] + time_cursor
-        text = segment['text'].lstrip()  # Remove leading space
-        id = segment['id'] + id_cursor
-        
-        # Convert start and end times to SRT format
-        start_srt = f"{int(start_time // 3600):02}:{int((start_time % 3600) // 60):02}:{int(start_time % 60):02},{int((start_time % 1) * 1000):03}"
-        end_srt = f"{int(end_time // 3600):02}:{int((end_time % 3600) // 60):02}:{int(end_time % 60):02},{int((end_time % 1) * 1000):03}"
-        
-        # Append to SRT string
-        srt += f"{id}\n{start_srt} --> {end_srt}\n{text}\n\n"
-        
-        # Update last_id and last_end_time
-        last_id = id
-        last_end_time = end_time
-    
-    return srt
+    out = io.StringIO()
+    write_subtitles(segments, {'srt': out})
+    return out.getvalue()
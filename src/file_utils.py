@@ -1,50 +1,124 @@
 import logging
-import docx
-import threading
 from config import Config
 import io
-from src.s3Bucket import upload_to_s3, Delete_Old_Files_From_S3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from src.s3Bucket import upload_to_s3, open_from_s3, object_exists, Delete_Old_Files_From_S3
+from src.subtitles import SUBTITLE_CONTENT_TYPES
+from src.scheduler import PeriodicTask
+from src.result_store import result_store, store_cleanup_task
+from src.jobs import current_job, job_context
 
 logger = logging.getLogger(__name__)
 
+DOCX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
 # Check file extension
 def allowed_file(filename, allowed_extensions=[]):
     """"Check if a file has an allowed extension"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
 # Save Transcription
-def save_transcription(transcription, timestamped_filename, srt=None, logger=logger):
-    """ Save transcription to a file on S3 """
+def save_transcription(transcription, timestamped_filename, subtitles=None, logger=logger):
+    """ Save transcription to a file on S3
+
+    The files are uploaded concurrently, without checking for existing files first since
+    their names are timestamped. The docx file is not built here but on its first download,
+    see ensure_docx.
+
+    args:
+        transcription (str): text of the transcription
+        timestamped_filename (str): name of the uploaded file, used for the names of the saved files
+        subtitles (dict): subtitle files by extension (e.g. 'srt'), as bytes or binary file-like objects
+
+    returns:
+        txt_path, docx_path, and the dict of the subtitle paths by extension
+    """
     logger.info(f"Saving transcription for {timestamped_filename}")
+    base_path = timestamped_filename.rsplit('.', 1)[0]
+    start_time = time.time()
     
-    # Save txt file
+    # txt file
     txt_content = f"{timestamped_filename}\n{transcription}\n{'-' * 80}\n"
-    txt_path = f"{timestamped_filename.rsplit('.', 1)[0]}.txt"
-    upload_to_s3(txt_content.encode('utf-8'), txt_path)
-    logger.info(f"Transcription saved to S3: {txt_path}")
+    txt_path = f"{base_path}.txt"
+    uploads = {txt_path: (txt_content.encode('utf-8'), 'text/plain; charset=utf-8')}
+    
+    # docx file, built from the txt file the first time it is downloaded
+    docx_path = f"{base_path}.docx"
+    
+    # subtitle files, streamed from their buffers
+    subtitle_paths = {}
+    for extension, content in (subtitles or {}).items():
+        subtitle_paths[extension] = f"{base_path}.{extension}"
+        uploads[subtitle_paths[extension]] = (content, SUBTITLE_CONTENT_TYPES.get(extension))
+    
+    job = current_job()
+    def upload(path, content, content_type):
+        with job_context(job):
+            upload_start = time.time()
+            response = upload_to_s3(content, path, logger=logger, check_exists=False, content_type=content_type)
+            return response, time.time() - upload_start
+    
+    with ThreadPoolExecutor(max_workers=len(uploads)) as executor:
+        futures = {path: executor.submit(upload, path, *upload_args) for path, upload_args in uploads.items()}
+    for path, future in futures.items():
+        response, latency = future.result()
+        if response is None:
+            logger.error(f"Transcription file not saved to S3: {path}")
+        else:
+            logger.info(f"Transcription saved to S3: {path} in {latency:.2f}s")
+    logger.info(f"Transcription files of {timestamped_filename} saved in {time.time() - start_time:.2f}s")
     
-    # Save docx file
+    return txt_path, docx_path, subtitle_paths
+
+def build_docx(transcription, timestamped_filename):
+    """Build the Word document of a transcription, returns its binary content."""
+    import docx  # only loaded when a docx file is downloaded
     doc = docx.Document()
     doc.add_heading(f'Transcript for {timestamped_filename}', 0)
     doc.add_paragraph(transcription)
     docx_binary = io.BytesIO()
     doc.save(docx_binary)
-    docx_binary.seek(0)
-    docx_path = f"{timestamped_filename.rsplit('.', 1)[0]}.docx"
-    upload_to_s3(docx_binary.getvalue(), docx_path)
-    logger.info(f"Transcription saved to S3: {docx_path}")
-    
-    # Save srt file if it exists
-    if srt:
-        srt_path = f"{timestamped_filename.rsplit('.', 1)[0]}.srt"
-        upload_to_s3(srt.encode('utf-8'), srt_path)
-        logger.info(f"SRT file saved to S3: {srt_path}")
-    else:
-        srt_path = None
-    
-    return txt_path, docx_path, srt_path
-
-def schedule_cleanup(cleanup_interval=Config.CLEANUP_INTERVAL):
-    """Schedule periodic cleanup of old transcript files."""
-    Delete_Old_Files_From_S3()
-    threading.Timer(cleanup_interval * 60, schedule_cleanup).start()
\ No newline at end of file
+    return docx_binary.getvalue()
+
+def ensure_docx(docx_path, logger=logger):
+    """Build and upload the docx file of a transcription from its txt file, unless already done.
+
+    returns:
+        True if the docx file exists in S3, False if it could not be built
+    """
+    if object_exists(docx_path, logger):
+        return True
+    
+    txt_path = f"{docx_path.rsplit('.', 1)[0]}.txt"
+    opened = open_from_s3(txt_path, logger)
+    if opened is None:
+        logger.error(f"Cannot build {docx_path}, no transcription found at {txt_path}")
+        return False
+    # The txt file holds the name of the transcribed file, the transcription and a separator line
+    lines = opened[0].decode('utf-8').split('\n')
+    timestamped_filename = lines[0]
+    transcription = '\n'.join(lines[1:-2])
+    
+    start_time = time.time()
+    response = upload_to_s3(build_docx(transcription, timestamped_filename), docx_path, logger=logger,
+                            check_exists=False, content_type=DOCX_CONTENT_TYPE)
+    if response is None:
+        return False
+    logger.info(f"Word document built and saved to S3: {docx_path} in {time.time() - start_time:.2f}s")
+    return True
+
+# Deletion of the expired files, off the request path
+cleanup_task = PeriodicTask(Delete_Old_Files_From_S3, Config.S3_SWEEP_INTERVAL, name="s3-cleanup")
+
+def schedule_cleanup(leader=True):
+    """Start the periodic cleanup of old files in S3 and of expired job statuses and results.
+
+    Args:
+        leader (bool): False in the server workers not running the periodic tasks (see
+            acquire_leadership), which only clean up their own in-memory result store.
+    """
+    if leader:
+        cleanup_task.start()
+    if leader or not result_store.shared:
+        store_cleanup_task.start()
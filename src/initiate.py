@@ -15,5 +15,5 @@ def initialize_app(app):
 
     # App configuration
     app.config.from_object(Config)
-    app.config['DEBUG'] = True
+    app.config['DEBUG'] = Config.DEBUG == "true"
     return app
\ No newline at end of file
@@ -0,0 +1,300 @@
+import logging
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from config import Config
+from src.result_store import result_store, JOB_STATUS
+from src.metrics import JOBS_FINISHED, JOB_QUEUE_DEPTH, ACTIVE_JOBS
+
+logger = logging.getLogger(__name__)
+
+# Job states
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+# Job run by the current worker thread
+_current = threading.local()
+
+def current_job():
+    """Return the job run by the calling worker thread, None outside of a job."""
+    return getattr(_current, 'job', None)
+
+@contextmanager
+def job_context(job):
+    """Run a block as part of job in a thread helping it, so its logs carry the id of the job."""
+    previous = current_job()
+    _current.job = job
+    try:
+        yield
+    finally:
+        _current.job = previous
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class JobManagerDraining(JobQueueFull):
+    """Raised when a job is submitted while the manager is shutting down."""
+
+
+class DuplicateJob(ValueError):
+    """Raised when a job is submitted with the id of a job still known."""
+
+
+class JobNotRetryable(Exception):
+    """Raised by a job when running it again cannot succeed, so it fails without retry."""
+
+
+class Job:
+    """A unit of background work with its state and timings."""
+
+    def __init__(self, job_id, func, args, kwargs):
+        self.id = job_id
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.state = JOB_QUEUED
+        self.attempt = 0
+        self.max_attempts = 1
+        self.error = None
+        self.result = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._finished = threading.Event()
+
+    def is_finished(self):
+        return self._finished.is_set()
+
+    def is_last_attempt(self):
+        return self.attempt >= self.max_attempts
+
+    def wait(self, timeout=None):
+        """Block until the job is done or failed. Returns True if it finished in time."""
+        return self._finished.wait(timeout)
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'state': self.state,
+            'attempt': self.attempt,
+            'error': self.error,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobManager:
+    """Bounded job queue consumed by a fixed pool of worker threads.
+
+    Args:
+        num_workers (int): number of worker threads running jobs.
+        max_queue_size (int): maximum number of jobs waiting for a worker.
+        retention (int): seconds a finished job is kept for status queries.
+        max_attempts (int): number of times a failing job is run before it is marked as failed.
+        retry_delay (float): seconds to wait before running a failed job again.
+        store: result store where the status of each job is published, so any worker can report it.
+    """
+
+    def __init__(self, num_workers=Config.JOB_WORKERS, max_queue_size=Config.JOB_QUEUE_SIZE,
+                 retention=Config.JOB_RETENTION, max_attempts=Config.JOB_MAX_ATTEMPTS,
+                 retry_delay=Config.JOB_RETRY_DELAY, store=None, logger=logger):
+        self.num_workers = num_workers
+        self.max_queue_size = max_queue_size
+        self.retention = retention
+        self.max_attempts = max(1, max_attempts)
+        self.retry_delay = retry_delay
+        self.store = store
+        self.logger = logger
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._workers = []
+        self._draining = False
+
+    def start(self):
+        """Start the worker threads, once."""
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self.num_workers):
+                worker = threading.Thread(target=self._worker_loop, name=f"job-worker-{i + 1}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+        self.logger.info(f"Job manager started with {self.num_workers} workers and a queue of {self.max_queue_size}")
+
+    def submit(self, func, *args, job_id=None, **kwargs):
+        """Queue func(*args, **kwargs) and return its Job right away.
+
+        Raises:
+            JobQueueFull: the queue is at capacity.
+            JobManagerDraining: the manager is shutting down.
+            DuplicateJob: a job with the same id is still known.
+        """
+        if self._draining:
+            raise JobManagerDraining("Shutting down, not accepting new jobs")
+        self.start()
+        self.cleanup()
+        job = Job(job_id or uuid.uuid4().hex, func, args, kwargs)
+        job.max_attempts = self.max_attempts
+        with self._lock:
+            if job.id in self._jobs:
+                raise DuplicateJob(f"Job {job.id} already exists")
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise JobQueueFull(f"Job queue is full ({self.max_queue_size} jobs waiting)")
+            self._jobs[job.id] = job
+        JOB_QUEUE_DEPTH.set(self._queue.qsize())
+        self._publish(job)
+        self.logger.info(f"Job {job.id} queued ({self._queue.qsize()} waiting)")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def get_status(self, job_id):
+        """Status of a job run by this process or, through the store, by any other."""
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if self.store is not None:
+            return self.store.get(JOB_STATUS, job_id)
+        return None
+
+    def wait_for(self, job_id, timeout, poll_interval=Config.JOB_STATUS_POLL_INTERVAL):
+        """Block until a job is done or failed, for up to timeout seconds.
+
+        Jobs of this process are waited for on their completion event, jobs run by another
+        worker by polling their status in the store.
+
+        Returns:
+            dict: last status of the job, None if it is unknown.
+        """
+        job = self.get(job_id)
+        if job is not None:
+            job.wait(timeout)
+            return job.to_dict()
+        deadline = time.monotonic() + timeout
+        while True:
+            status = self.store.get(JOB_STATUS, job_id) if self.store is not None else None
+            remaining = deadline - time.monotonic()
+            if status is None or status['state'] in (JOB_DONE, JOB_FAILED) or remaining <= 0:
+                return status
+            time.sleep(min(poll_interval, remaining))
+
+    def _publish(self, job):
+        if self.store is None:
+            return
+        try:
+            self.store.put(JOB_STATUS, job.id, job.to_dict())
+        except Exception as e:
+            self.logger.error(f"Cannot publish the status of job {job.id}: {e}")
+
+    def stats(self):
+        """Queue depth, running jobs and how long the oldest queued job has been waiting."""
+        now = time.time()
+        with self._lock:
+            jobs = list(self._jobs.values())
+        queued = [job for job in jobs if job.state == JOB_QUEUED]
+        return {
+            'workers': self.num_workers,
+            'queue_capacity': self.max_queue_size,
+            'queued': len(queued),
+            'running': sum(job.state == JOB_RUNNING for job in jobs),
+            'done': sum(job.state == JOB_DONE for job in jobs),
+            'failed': sum(job.state == JOB_FAILED for job in jobs),
+            'oldest_queued_seconds': max((now - job.submitted_at for job in queued), default=0),
+        }
+
+    def is_draining(self):
+        return self._draining
+
+    def is_alive(self):
+        """False if a started worker thread has died."""
+        with self._lock:
+            return all(worker.is_alive() for worker in self._workers)
+
+    def is_full(self):
+        return self._queue.full()
+
+    def drain(self, timeout=None):
+        """Stop accepting jobs and wait for the queued and running ones to finish.
+
+        Returns:
+            bool: True if every job finished within timeout seconds.
+        """
+        self._draining = True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self.logger.info(f"Draining job manager: {self._queue.unfinished_tasks} jobs queued or running")
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self.logger.warning(f"Drain timed out with {self._queue.unfinished_tasks} jobs unfinished")
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        self.logger.info("Job manager drained")
+        return True
+
+    def cleanup(self):
+        """Forget finished jobs older than the retention period."""
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.is_finished() and now - job.finished_at > self.retention]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def _worker_loop(self):
+        while True:
+            job = self._queue.get()
+            JOB_QUEUE_DEPTH.set(self._queue.qsize())
+            try:
+                self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job):
+        job.state = JOB_RUNNING
+        job.started_at = time.time()
+        _current.job = job
+        ACTIVE_JOBS.inc()
+        self._publish(job)
+        self.logger.info(f"Job {job.id} started after {job.started_at - job.submitted_at:.2f}s in queue")
+        try:
+            while True:
+                job.attempt += 1
+                try:
+                    job.result = job.func(*job.args, **job.kwargs)
+                    job.state = JOB_DONE
+                    break
+                except Exception as e:
+                    job.error = str(e)
+                    if job.is_last_attempt() or isinstance(e, JobNotRetryable):
+                        job.state = JOB_FAILED
+                        self.logger.error(f"Job {job.id} failed: {e}")
+                        break
+                    self._publish(job)
+                    self.logger.warning(f"Job {job.id} attempt {job.attempt} failed, retrying in {self.retry_delay}s: {e}")
+                    time.sleep(self.retry_delay)
+        finally:
+            _current.job = None
+            job.finished_at = time.time()
+            ACTIVE_JOBS.dec()
+            JOBS_FINISHED.labels(state=job.state).inc()
+            self._publish(job)
+            job._finished.set()
+            self.logger.info(f"Job {job.id} {job.state} in {job.finished_at - job.started_at:.2f}s")
+
+
+# Process-wide job manager, workers are started on first submit
+job_manager = JobManager(store=result_store)
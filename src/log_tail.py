@@ -0,0 +1,166 @@
+import html
+import logging
+import os
+import re
+import time
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# First line of a record written with Config.LOG_FORMAT, lines that do not match (tracebacks) continue the previous one.
+# Records written before job ids were logged have no [job_id] part.
+RECORD_PATTERN = re.compile(
+    r'^(?P<time>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) - (?P<logger>\S+) - (?P<level>[A-Z]+) - '
+    r'(?:\[(?P<job_id>.*?)\] )?(?P<message>.*)$'
+)
+BLOCK_SIZE = 64 * 1024
+
+def parse_level(level):
+    """Return the numeric value of a level name (e.g. 'warning'), None if no level is given."""
+    if not level:
+        return None
+    value = logging.getLevelName(level.upper())
+    if not isinstance(value, int):
+        raise ValueError(f"Unknown log level: {level}")
+    return value
+
+def _make_record(offset, match, continuation):
+    job_id = match.group('job_id')
+    message = match.group('message')
+    if continuation:
+        message = '\n'.join([message, *continuation])
+    return {
+        'offset': offset,
+        'time': match.group('time'),
+        'logger': match.group('logger'),
+        'level': match.group('level'),
+        'job_id': None if job_id in (None, '-') else job_id,
+        'message': message,
+    }
+
+def _matches(record, min_level, job_id):
+    if min_level is not None and logging.getLevelName(record['level']) < min_level:
+        return False
+    return job_id is None or record['job_id'] == job_id
+
+def _lines_backwards(log_file, end, block_size=BLOCK_SIZE):
+    """Yield the (offset, line) of the lines before end, the last one first, reading block by block."""
+    position = end
+    remainder = b''
+    while position > 0:
+        size = min(block_size, position)
+        position -= size
+        log_file.seek(position)
+        lines = (log_file.read(size) + remainder).split(b'\n')  # bytes position to end
+        remainder = lines.pop(0)  # may start in the previous block
+        offset = end
+        for line in reversed(lines):
+            offset -= len(line)
+            yield offset, line
+            offset -= 1  # newline before the line
+        end = position + len(remainder)
+    if remainder:
+        yield 0, remainder
+
+def read_log_tail(path=Config.LOG_FILE, limit=Config.LOG_TAIL_LINES, min_level=None, job_id=None, before=None,
+                  max_scan=Config.LOG_TAIL_MAX_SCAN_BYTES):
+    """Return the last records of the log file, reading it backwards from the end.
+
+    Args:
+        limit (int): maximum number of records returned.
+        min_level (int): only records at this level or above.
+        job_id (str): only records logged by this job.
+        before (int): cursor of a previous call, to get the records before the ones it returned.
+        max_scan (int): bytes read at most, so a filter matching nothing does not read the whole file.
+
+    Returns:
+        list: records, oldest first.
+        int: cursor to pass as before for the previous records, None at the start of the file.
+        int: size of the file, cursor to pass to follow_log for the next records.
+    """
+    records = []
+    with open(path, 'rb') as log_file:
+        size = os.fstat(log_file.fileno()).st_size
+        end = size if before is None else min(before, size)
+        cursor = None
+        continuation = []  # lines after the first line of a record, last first
+        for offset, line in _lines_backwards(log_file, end):
+            line = line.decode('utf-8', errors='replace').rstrip('\r')
+            match = RECORD_PATTERN.match(line)
+            if match is None:
+                if line:
+                    continuation.append(line)
+                continue
+            record = _make_record(offset, match, continuation[::-1])
+            continuation = []
+            if _matches(record, min_level, job_id):
+                records.append(record)
+            if len(records) >= limit or end - offset >= max_scan:
+                cursor = offset if offset > 0 else None
+                break
+    records.reverse()
+    return records, cursor, size
+
+def follow_log(path=Config.LOG_FILE, after=None, min_level=None, job_id=None,
+               duration=Config.LOG_FOLLOW_MAX_DURATION, poll_interval=Config.LOG_FOLLOW_POLL_INTERVAL,
+               keepalive=Config.SSE_KEEPALIVE_INTERVAL):
+    """Yield the records appended to the log file, like tail -f, for up to duration seconds.
+
+    Each record has a 'next' cursor, to resume after it. None is yielded when nothing was
+    logged for keepalive seconds. The file is read again from its start when it is rotated.
+
+    Args:
+        after (int): cursor where to start, the end of the file by default.
+    """
+    stat = os.stat(path)
+    inode = stat.st_ino
+    position = stat.st_size if after is None else after
+    deadline = time.monotonic() + duration
+    last_sent = time.monotonic()
+    while time.monotonic() < deadline:
+        stat = os.stat(path)
+        if stat.st_ino != inode or stat.st_size < position:
+            inode, position = stat.st_ino, 0
+        data = b''
+        if stat.st_size > position:
+            with open(path, 'rb') as log_file:
+                log_file.seek(position)
+                data = log_file.read(min(stat.st_size - position, Config.LOG_TAIL_MAX_SCAN_BYTES))
+            data = data[:data.rfind(b'\n') + 1]  # complete lines only
+        record = None
+        for line in data.splitlines(keepends=True):
+            offset, position = position, position + len(line)
+            text = line.decode('utf-8', errors='replace').rstrip('\r\n')
+            match = RECORD_PATTERN.match(text)
+            if match is None:
+                if record is not None and text:
+                    record['message'] += '\n' + text
+                    record['next'] = position
+                continue
+            if record is not None and _matches(record, min_level, job_id):
+                last_sent = time.monotonic()
+                yield record
+            record = _make_record(offset, match, [])
+            record['next'] = position
+        # A record is written at once, its traceback included
+        if record is not None and _matches(record, min_level, job_id):
+            last_sent = time.monotonic()
+            yield record
+        if not data:
+            if time.monotonic() - last_sent >= keepalive:
+                last_sent = time.monotonic()
+                yield None
+            time.sleep(poll_interval)
+
+def format_record_html(record):
+    """Colorized HTML line of a record, its content escaped."""
+    timestamp = f'<span style="color: cyan;">{record["time"]}</span>'
+    logger_name = f'<span style="color: lightblue;">{html.escape(record["logger"])}</span>'
+    level = html.escape(record['level'])
+    message = html.escape(record['message'])
+    job = f' [{html.escape(record["job_id"])}]' if record['job_id'] else ''
+    color = {'ERROR': 'red', 'CRITICAL': 'red', 'INFO': 'green', 'WARNING': 'yellow'}.get(record['level'])
+    if color:
+        level = f'<span style="color: {color};">{level}</span>'
+        message = f'<span style="color: {color};">{message}</span>'
+    return f"{timestamp} - {logger_name} - {level} -{job} {message}"
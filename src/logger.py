@@ -1,21 +1,60 @@
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, WatchedFileHandler
 import os
 from config import Config
+from src.jobs import current_job
+from src.scheduler import PeriodicTask
 
-def setup_logger():
-    """Configure centralized logging for the application."""
+
+class JobContextFilter(logging.Filter):
+    """Add the id of the job run by the logging thread to each record, '-' outside of jobs."""
+
+    def filter(self, record):
+        job = current_job()
+        record.job_id = job.id if job is not None else '-'
+        return True
+
+def rotate_log_file(path=Config.LOG_FILE, max_bytes=Config.LOG_MAX_BYTES, backup_count=Config.LOG_BACKUP_COUNT):
+    """Rotate the log file like RotatingFileHandler (path.1 ... path.backup_count) once it reaches max_bytes.
+
+    Used when several processes append to the file: their WatchedFileHandler reopens it after the rotation.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) < max_bytes:
+        return
+    for index in range(backup_count - 1, 0, -1):
+        if os.path.exists(f"{path}.{index}"):
+            os.replace(f"{path}.{index}", f"{path}.{index + 1}")
+    if backup_count > 0:
+        os.replace(path, f"{path}.1")
+    else:
+        os.remove(path)
+
+# Run by the worker holding the scheduler lock, see wsgi.py
+log_rotation_task = PeriodicTask(rotate_log_file, Config.LOG_ROTATE_INTERVAL, name="log-rotation")
+
+def setup_logger(shared_file=False):
+    """Configure centralized logging for the application.
+
+    Args:
+        shared_file (bool): the log file is written by several processes (gunicorn workers).
+            RotatingFileHandler is not safe across processes: the file is then appended to
+            with a WatchedFileHandler and rotated by log_rotation_task in a single process.
+    """
     
     # Create formatter
     formatter = logging.Formatter(Config.LOG_FORMAT)
     
     # Configure file handler
-    file_handler = RotatingFileHandler(
-        Config.LOG_FILE,
-        maxBytes=Config.LOG_MAX_BYTES,
-        backupCount=Config.LOG_BACKUP_COUNT
-    )
+    if shared_file:
+        file_handler = WatchedFileHandler(Config.LOG_FILE)
+    else:
+        file_handler = RotatingFileHandler(
+            Config.LOG_FILE,
+            maxBytes=Config.LOG_MAX_BYTES,
+            backupCount=Config.LOG_BACKUP_COUNT
+        )
     file_handler.setFormatter(formatter)
+    file_handler.addFilter(JobContextFilter())
     file_handler.setLevel(Config.LOG_LEVEL)
     
     # Configure root logger
@@ -1,10 +1,24 @@
 from config import Config
+import logging
 import re
+import numpy as np
 
-def merge_transcriptions(results):
-    """Merge transcription chunks and handle overlaps."""
+logger = logging.getLogger(__name__)
+
+def merge_transcriptions(results, strategy = Config.MERGE_STRATEGY, logger = logger):
+    """Merge transcription chunks and handle overlaps.
+
+    With the "words" strategy, overlaps are resolved with the word timestamps of the chunks
+    (see merge_transcriptions_by_words). The texts of the overlaps are aligned instead when
+    the strategy is "text" or when a chunk has no word timestamps.
+    """
+    if strategy == "words":
+        if all(has_word_timestamps(chunk) for chunk, _ in results):
+            return merge_transcriptions_by_words(results)
+        logger.warning("Word timestamps missing in a chunk, merging by text alignment")
     final_segments = []
     processed_chunks = []
+    cut_in_silence = set() # chunks followed by the next one without overlap
     
     # harmonize id and timestamp between chunks
     firstChunkID = 0
@@ -33,12 +47,18 @@ def merge_transcriptions(results):
             if overlap_segments:
                 merged_overlap = overlap_segments[0].copy()
                 firstChunkID = merged_overlap['id'] + 1 # get the first ID for next chunk
-                paddedTimeForNextChunk = overlap_segments[-1]['end'] - Config.GROQ_OVERLAP_TIME # time of the last segment
+                paddedTimeForNextChunk = next_start / 1000 # the next chunk starts at its offset
                 merged_overlap.update({
                     'text': ' '.join(s['text'] for s in overlap_segments),
                     'end': overlap_segments[-1]['end'] # time of the last segment
                 })
                 current_segments.append(merged_overlap)
+            elif next_start is not None:
+                # Chunk cut without overlap (e.g. in a silence)
+                cut_in_silence.add(i)
+                if current_segments:
+                    firstChunkID = current_segments[-1]['id'] + 1
+                paddedTimeForNextChunk = next_start / 1000
             
             processed_chunks.append(current_segments)
         else:
@@ -47,6 +67,9 @@ def merge_transcriptions(results):
     # Harmonize start and end times between chunks
         
     for i in range(len(processed_chunks) - 1):
+        if i in cut_in_silence or not processed_chunks[i] or not processed_chunks[i + 1]:
+            final_segments.extend(processed_chunks[i]) # nothing was said twice, no text to align
+            continue
         final_segments.extend(processed_chunks[i][:-1]) # append chunk segments except the last one
         last_segment = processed_chunks[i][-1] # last segment
         first_segment = processed_chunks[i + 1][0] # first segment of next chunk
@@ -68,6 +91,80 @@ def merge_transcriptions(results):
         "segments": final_segments
     }
 
+def has_word_timestamps(chunk):
+    """True when a chunk result has word timestamps, or nothing was said in it."""
+    return bool(getattr(chunk, 'words', None)) or not chunk.segments
+
+def merge_transcriptions_by_words(results):
+    """Merge transcription chunks by dropping the words said twice in overlaps, using their timestamps.
+
+    All times are made absolute with the offset of their chunk. Between two chunks, the seam is
+    the middle of their overlap: from the start of the next chunk to the end of the last word of
+    the current one. A word is kept by the chunk whose side of the seam its middle falls on, then
+    each segment is rebuilt from the words it kept. Linear in the number of words.
+
+    Args:
+        results (list): (result, offset) tuples in chunk order, every result with words and segments.
+
+    Returns:
+        dict: text and segments of the whole audio, segment ids numbered from 0.
+    """
+    final_segments = []
+    seam_before = float('-inf')
+    
+    for i, (chunk, offset) in enumerate(results):
+        padding = offset / 1000
+        words = [(word['start'] + padding, word['end'] + padding, word['word']) for word in (getattr(chunk, 'words', None) or [])]
+        
+        if i < len(results) - 1:
+            next_start = results[i + 1][1] / 1000
+            last_word_end = max((end for _, end, _ in words), default=next_start)
+            seam_after = (next_start + max(last_word_end, next_start)) / 2
+        else:
+            seam_after = float('inf')
+        
+        # Words of each segment: the last segment starting before the middle of the word
+        segments = chunk.segments
+        segment_words = [[] for _ in segments]
+        current = 0
+        for start, end, text in words:
+            middle = (start + end) / 2
+            while current + 1 < len(segments) and segments[current + 1]['start'] + padding <= middle:
+                current += 1
+            if segments:
+                segment_words[current].append((start, end, text, seam_before <= middle < seam_after))
+        
+        for segment, assigned in zip(segments, segment_words):
+            start, end = segment['start'] + padding, segment['end'] + padding
+            if not assigned:
+                # No word in the segment, keep it on the side of the seam its middle falls on
+                if seam_before <= (start + end) / 2 < seam_after:
+                    final_segments.append(dict(segment, id=len(final_segments), start=start, end=end))
+                continue
+            kept = [index for index, word in enumerate(assigned) if word[3]]
+            if not kept:
+                continue
+            if len(kept) == len(assigned):
+                final_segments.append(dict(segment, id=len(final_segments), start=start, end=end))
+                continue
+            tokens = segment['text'].split()
+            if len(tokens) == len(assigned):
+                # Tokens of the text keep the punctuation the words do not have
+                text = ' ' + ' '.join(tokens[index] for index in kept)
+            else:
+                text = ' ' + ' '.join(assigned[index][2].strip() for index in kept)
+            final_segments.append(dict(segment, id=len(final_segments), text=text,
+                                       start=assigned[kept[0]][0], end=assigned[kept[-1]][1]))
+        
+        seam_before = seam_after
+    
+    final_text = ' \n'.join(segment['text'] for segment in final_segments)
+    
+    return {
+        "text": final_text,
+        "segments": final_segments
+    }
+
 def find_longest_common_sequence(sequences):
     """Find the optimal alignment between sequences with longest common sequence and sliding window matching."""
     if not sequences:
@@ -75,39 +172,78 @@ def find_longest_common_sequence(sequences):
     
     sequences = [[word for word in re.split(r'(\s+\w+)', seq) if word] for seq in sequences]
     left_sequence = sequences[0]
-    left_length = len(left_sequence)
     total_sequence = []
     
     for right_sequence in sequences[1:]:
-        max_matching = 0.0
-        right_length = len(right_sequence)
-        max_indices = (left_length, left_length, 0, 0)
-        
-        for i in range(1, left_length + right_length + 1):
-            eps = float(i) / 10000.0
-            left_start = max(0, left_length - i)
-            left_stop = min(left_length, left_length + right_length - i)
-            left = left_sequence[left_start:left_stop]
-            right_start = max(0, i - left_length)
-            right_stop = min(right_length, i)
-            right = right_sequence[right_start:right_stop]
-            
-            if len(left) != len(right):
-                raise RuntimeError("Mismatched subsequences detected during transcript merging.")
-            
-            matches = sum(a == b for a, b in zip(left, right))
-            matching = matches / float(i) + eps
-            
-            if matches > 1 and matching > max_matching:
-                max_matching = matching
-                max_indices = (left_start, left_stop, right_start, right_stop)
-        
-        left_start, left_stop, right_start, right_stop = max_indices
+        left_start, left_stop, right_start, right_stop = best_alignment(left_sequence, right_sequence)
         left_mid = (left_stop + left_start) // 2
         right_mid = (right_stop + right_start) // 2
         total_sequence.extend(left_sequence[:left_mid])
         left_sequence = right_sequence[right_mid:]
-        left_length = len(left_sequence)
     
     total_sequence.extend(left_sequence)
-    return ''.join(total_sequence)
\ No newline at end of file
+    return ''.join(total_sequence)
+
+# Pairs of equal tokens scored at once, above this (e.g. a seam repeating "[music]") shifts are scored one by one
+MAX_ALIGNMENT_PAIRS = 1 << 20
+
+def best_alignment(left_sequence, right_sequence):
+    """Return the (left_start, left_stop, right_start, right_stop) window where the end of the left
+    sequence best matches the start of the right one.
+
+    Sliding the right sequence under the left one by i tokens (1 <= i <= left + right) overlaps
+    i tokens at most, scored matches / i + i / 10000. Instead of comparing the windows of every
+    shift, tokens are interned to integers and every pair of equal tokens votes for the single
+    shift that aligns them, so all shifts are scored at once with numpy. When repeated tokens
+    make more than MAX_ALIGNMENT_PAIRS pairs, the windows of each shift are compared instead,
+    keeping the memory linear.
+    The first shift with the best score and more than one match wins, (left, left, 0, 0) if none.
+    """
+    left_length = len(left_sequence)
+    right_length = len(right_sequence)
+    no_match = (left_length, left_length, 0, 0)
+    if not left_length or not right_length:
+        return no_match
+    
+    # Intern the tokens
+    token_ids = {}
+    left_ids = np.fromiter((token_ids.setdefault(token, len(token_ids)) for token in left_sequence),
+                           dtype=np.int64, count=left_length)
+    right_ids = np.fromiter((token_ids.setdefault(token, len(token_ids)) for token in right_sequence),
+                            dtype=np.int64, count=right_length)
+    
+    # Pair every left token with the positions of the same token in the right sequence
+    right_order = np.argsort(right_ids, kind='stable')
+    sorted_right_ids = right_ids[right_order]
+    first = np.searchsorted(sorted_right_ids, left_ids, side='left')
+    last = np.searchsorted(sorted_right_ids, left_ids, side='right')
+    counts = last - first
+    pair_count = int(counts.sum())
+    if not pair_count:
+        return no_match
+    shifts = np.arange(1, left_length + right_length + 1)
+    if pair_count > MAX_ALIGNMENT_PAIRS:
+        matches = np.fromiter(
+            (np.count_nonzero(left_ids[max(0, left_length - i):min(left_length, left_length + right_length - i)]
+                              == right_ids[max(0, i - left_length):min(right_length, i)])
+             for i in range(1, left_length + right_length + 1)),
+            dtype=np.int64, count=left_length + right_length)
+    else:
+        left_positions = np.repeat(np.arange(left_length), counts)
+        # Index in sorted_right_ids of each pair: start of its run plus its rank inside the run
+        run_starts = np.repeat(first, counts)
+        ranks = np.arange(pair_count) - np.repeat(np.cumsum(counts) - counts, counts)
+        right_positions = right_order[run_starts + ranks]
+        
+        # Left token a faces right token b when the right sequence is shifted by left - a + b
+        matches = np.bincount(left_length - left_positions + right_positions,
+                              minlength=left_length + right_length + 1)[1:]
+    matching = matches / shifts.astype(np.float64) + shifts / 10000.0
+    matching[matches <= 1] = -np.inf
+    best = int(np.argmax(matching))
+    if matching[best] == -np.inf:
+        return no_match
+    
+    i = best + 1
+    return (max(0, left_length - i), min(left_length, left_length + right_length - i),
+            max(0, i - left_length), min(right_length, i))
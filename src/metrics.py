@@ -0,0 +1,93 @@
+import os
+import time
+from prometheus_client import (Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, generate_latest,
+                               CONTENT_TYPE_LATEST, multiprocess)
+
+# Gunicorn workers share their metrics through files when PROMETHEUS_MULTIPROC_DIR is set, see gunicorn.conf.py
+MULTIPROCESS = 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+
+# ********************************************* Pipeline *********************************************
+# download, preprocess, split, decode (streaming pipeline), transcribe, merge, subtitles, upload
+STAGE_SECONDS = Histogram(
+    'transcript_stage_seconds', 'Duration of each stage of a transcription job', ['stage'],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600),
+)
+JOBS_FINISHED = Counter('transcript_jobs_finished_total', 'Jobs finished, by final state', ['state'])
+JOB_QUEUE_DEPTH = Gauge('transcript_job_queue_depth', 'Jobs waiting for a worker', multiprocess_mode='livesum')
+ACTIVE_JOBS = Gauge('transcript_active_jobs', 'Jobs being run', multiprocess_mode='livesum')
+
+# ********************************************* Provider *********************************************
+PROVIDER_REQUEST_SECONDS = Histogram(
+    'transcript_provider_request_seconds', 'Latency of each transcription request sent to the provider',
+    buckets=(0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300),
+)
+PROVIDER_RATE_LIMITED = Counter('transcript_provider_rate_limited_total', 'Transcription requests answered with a 429')
+# rate_limited, server_error, connection_error
+PROVIDER_RETRIES = Counter('transcript_provider_retries_total', 'Transcription requests sent again', ['reason'])
+PROVIDER_FAILURES = Counter('transcript_provider_failures_total', 'Chunks given up after an error or too many retries')
+
+# ********************************************* Transfers *********************************************
+# s3_download, s3_upload, provider_upload
+BYTES_TRANSFERRED = Counter('transcript_bytes_total', 'Bytes moved to or from S3 and the provider', ['transfer'])
+
+def time_stage(stage):
+    """Context manager recording the duration of a stage of a transcription job."""
+    return STAGE_SECONDS.labels(stage=stage).time()
+
+def observe_stage(stage, seconds):
+    """Record the duration of a stage measured by the caller, e.g. one that ends in another thread."""
+    STAGE_SECONDS.labels(stage=stage).observe(seconds)
+
+class TimedIterator:
+    """Wrap an iterator and record the time spent producing its items as the duration of stage.
+
+    The time the consumer keeps each item is left out, so a generator decoding ahead of a slower
+    consumer is measured by its own work only. Recorded once the iterator is exhausted.
+    """
+
+    def __init__(self, iterable, stage):
+        self._iterator = iter(iterable)
+        self._stage = stage
+        self._seconds = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            observe_stage(self._stage, self._seconds + time.perf_counter() - started)
+            raise
+        finally:
+            self._seconds += time.perf_counter() - started
+
+    def close(self):
+        if hasattr(self._iterator, 'close'):
+            self._iterator.close()
+
+def count_bytes(transfer, content):
+    """Add the size of content (bytes, in-memory or real file) to the bytes moved by transfer."""
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        size = len(content)
+    elif hasattr(content, 'getbuffer'):
+        size = content.getbuffer().nbytes
+    elif hasattr(content, 'fileno'):
+        size = os.fstat(content.fileno()).st_size
+    else:
+        return
+    BYTES_TRANSFERRED.labels(transfer=transfer).inc(size)
+
+def render_metrics():
+    """Metrics of the process, or of every worker in multiprocess mode, in the Prometheus text format.
+
+    Returns:
+        bytes: the exposition.
+        str: its content type.
+    """
+    registry = REGISTRY
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,5 +1,4 @@
 from config import Config
-from pydub import AudioSegment
 import logging
 import io
 import os
@@ -7,6 +6,10 @@ from datetime import datetime
 import subprocess
 import tempfile
 import struct
+import threading
+import numpy as np
+from src.silence import frame_energies, find_quietest_frame, FRAME_SECONDS
+from src.chunk_planner import plan_chunks, max_chunk_length, CHUNK_OVERLAP, SILENCE_SEARCH_WINDOW
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +36,7 @@ def extract_audio(video_binary, file_type, logger=logger):
             return video_binary
         
         # Load video binary as audio using pydub
+        from pydub import AudioSegment  # slow to import, only needed without the streaming pipeline
         video_stream = io.BytesIO(video_binary)
         audio = AudioSegment.from_file(video_stream, format=file_type)
         
@@ -53,6 +57,7 @@ def preprocess_audio(audio_binary):
     """Preprocess binary audio file to 16kHz mono FLAC using pydub."""
     try:
         logger.info("Preprocessing audio")
+        from pydub import AudioSegment
         audio = AudioSegment.from_file(io.BytesIO(audio_binary))
         audio = audio.set_frame_rate(16000).set_channels(1)
         processed_audio_binary = io.BytesIO()
@@ -64,25 +69,255 @@ def preprocess_audio(audio_binary):
         logger.error(f"Audio conversion failed: {e}")
         raise RuntimeError(f"Audio conversion failed: {e}")
 
-def split_audio_into_chunks(audio_binary, chunk_length=600, overlap=Config.GROQ_OVERLAP_TIME):
-    """Split binary audio into chunks with overlap."""
+def split_audio_into_chunks(audio_binary, plan=None):
+    """Split binary audio into the chunks of a plan, computed from the audio when not given.
+
+    Returns:
+        list: (chunk, offset) pairs, offset being the start of the chunk in milliseconds.
+    """
+    from pydub import AudioSegment
     audio = AudioSegment.from_file(io.BytesIO(audio_binary), format="flac")
-    duration = len(audio)
-    chunk_ms = chunk_length * 1000
-    overlap_ms = overlap * 1000
+    if plan is None:
+        duration = len(audio) / 1000
+        energies = None
+        if SILENCE_SEARCH_WINDOW:
+            energies = frame_energies(np.array(audio.get_array_of_samples(), dtype=np.int16), audio.frame_rate)
+        plan = plan_chunks(duration, len(audio_binary), energies)
+    if plan.is_single_request():
+        # Small enough to be sent as is
+        return [(io.BytesIO(audio_binary), 0)]
     chunks = []
     
-    for start in range(0, duration, chunk_ms - overlap_ms):
-        end = min(start + chunk_ms, duration)
-        chunk_audio = audio[start:end]
+    for (start, end), offset in zip(plan.boundaries, plan.offsets):
+        chunk_audio = audio[offset:int(round(end * 1000))]
         chunk_binary = io.BytesIO()
         chunk_audio.export(chunk_binary, format='flac')
         chunk_binary.seek(0)
-        chunks.append(chunk_binary)
+        chunks.append((chunk_binary, offset))
     
     return chunks
 
 
+# ******************************************** Streaming processing ************************************************
+
+SAMPLE_RATE = 16000  # Hz, mono 16-bit PCM between the decoder and the chunk encoder
+PCM_BYTES_PER_SECOND = SAMPLE_RATE * 2
+STREAM_BLOCK_SIZE = 1024 * 1024  # bytes read from / written to ffmpeg at once
+
+SOURCE_SPOOL_MEMORY = 64 * 1024 * 1024  # bytes of a streamed source kept in memory before spooling to disk
+
+# Containers that may keep their index at the end of the file and need a seekable input
+SEEKABLE_INPUT_TYPES = {'mp4', 'm4a', 'mov'}
+
+
+class SourceSpool:
+    """Buffer between a source read as fast as it comes and a reader going at its own pace.
+
+    The decoder stops reading its input while the chunks it produced wait for a transcription
+    slot. Read directly, an S3 StreamingBody would sit idle meanwhile and hit the S3 read
+    timeout on long files, so a thread downloads it into a temporary file, in memory up to
+    SOURCE_SPOOL_MEMORY bytes, that the decoder reads from. on_done is called once the whole
+    source was read, to time the download.
+    """
+
+    def __init__(self, source, max_memory=SOURCE_SPOOL_MEMORY, on_done=None):
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_memory)
+        self._written = 0
+        self._read = 0
+        self._done = False
+        self._condition = threading.Condition()
+        self._on_done = on_done
+        self._thread = threading.Thread(target=self._fill, args=(source,), daemon=True)
+        self._thread.start()
+
+    def _fill(self, source):
+        try:
+            while True:
+                block = source.read(STREAM_BLOCK_SIZE)
+                if not block:
+                    break
+                with self._condition:
+                    if self._file.closed:
+                        return  # the decoding was stopped
+                    self._file.seek(self._written)
+                    self._file.write(block)
+                    self._written += len(block)
+                    self._condition.notify_all()
+            if self._on_done is not None:
+                self._on_done()
+        except Exception as e:
+            logger.error(f"Error downloading the source: {e}")  # the decoder sees a truncated input
+        finally:
+            with self._condition:
+                self._done = True
+                self._condition.notify_all()
+
+    def read(self, size):
+        """Read up to size bytes, waiting for the download. Returns b'' at the end of the source."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._read < self._written or self._done)
+            if self._read >= self._written:
+                return b''
+            self._file.seek(self._read)
+            block = self._file.read(min(size, self._written - self._read))
+            self._read += len(block)
+            return block
+
+    def close(self):
+        with self._condition:
+            self._file.close()
+            self._done = True
+            self._written = self._read = 0
+            self._condition.notify_all()
+
+def stream_audio_into_chunks(source, file_type=None, chunk_length=None, overlap=CHUNK_OVERLAP,
+                             search_window=SILENCE_SEARCH_WINDOW, logger=logger):
+    """Decode audio or video with one ffmpeg process and yield 16kHz mono FLAC chunks with overlap.
+
+    The source is piped to a decoding ffmpeg process, which outputs 16kHz mono PCM. Only one
+    chunk of PCM is buffered: as soon as it is complete it is cut, encoded to FLAC by a short-lived
+    ffmpeg process (encode_pcm_to_flac) and yielded, so peak memory does not depend on the
+    duration of the source. A file-like source is downloaded through a SourceSpool (unless it is one), so it keeps
+    being read while the decoder waits for the chunks to be consumed. With a search window, the chunk is cut at
+    the quietest point of its last search_window seconds instead of at chunk_length.
+
+    The duration is unknown until the end of the stream, so the chunks are planned as they go:
+    the first one is sized for raw PCM, the next ones for the highest FLAC bitrate measured so far.
+    Audio shorter than a chunk is sent as a single request.
+
+    Args:
+        source (bytes or file-like): binary content of the uploaded file, closed at the end when it is a SourceSpool.
+        file_type (str): file extension, used to allow seeking in MP4-like containers.
+        chunk_length (int): length of a chunk in seconds, None to size chunks from the upload limit.
+        overlap (int): overlap between consecutive chunks in seconds.
+        search_window (int): seconds before chunk_length searched for a silence, None to cut at chunk_length.
+
+    Yields:
+        io.BytesIO: FLAC chunk.
+        int: start of the chunk in milliseconds.
+    """
+    adaptive = chunk_length is None
+    if adaptive:
+        chunk_length = max_chunk_length(PCM_BYTES_PER_SECOND)
+    chunk_bytes = chunk_length * PCM_BYTES_PER_SECOND
+    max_bitrate = 0
+    overlap_bytes = int(overlap * PCM_BYTES_PER_SECOND)
+    frame_bytes = int(FRAME_SECONDS * PCM_BYTES_PER_SECOND)
+    
+    # The cache protocol lets ffmpeg seek back in a piped MP4 whose index is at the end
+    input_url = 'cache:pipe:0' if file_type in SEEKABLE_INPUT_TYPES else 'pipe:0'
+    command = [
+        'ffmpeg', '-v', 'error', '-i', input_url,
+        '-vn',                                   # Disable video recording
+        '-ar', str(SAMPLE_RATE),                 # Set audio sample rate to 16kHz
+        '-ac', '1',                              # Set audio to mono (1 channel)
+        '-f', 's16le', 'pipe:1'                  # Raw PCM on stdout
+    ]
+    spool = None
+    if isinstance(source, SourceSpool):
+        spool = source
+    elif not isinstance(source, (bytes, bytearray)):
+        source = spool = SourceSpool(source)
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    errors = []
+    writer = threading.Thread(target=_feed_process, args=(process.stdin, source), daemon=True)
+    error_reader = threading.Thread(target=lambda: errors.append(process.stderr.read()), daemon=True)
+    writer.start()
+    error_reader.start()
+    
+    buffer = bytearray()
+    buffer_start = 0  # position of the buffer in the PCM stream, in bytes
+    chunk_count = 0
+    try:
+        while True:
+            block = process.stdout.read(STREAM_BLOCK_SIZE)
+            if block:
+                buffer += block
+            while len(buffer) >= chunk_bytes:
+                cut_bytes = chunk_bytes
+                if search_window:
+                    # Quietest point of the end of the chunk, never before the overlap
+                    search_start = max(overlap_bytes + frame_bytes, chunk_bytes - int(search_window * PCM_BYTES_PER_SECOND))
+                    search_start -= search_start % frame_bytes
+                    energies = frame_energies(buffer[search_start:chunk_bytes], SAMPLE_RATE)
+                    cut_bytes = search_start + find_quietest_frame(energies, 0, len(energies)) * frame_bytes
+                chunk = encode_pcm_to_flac(buffer[:cut_bytes])
+                yield chunk, buffer_start * 1000 // PCM_BYTES_PER_SECOND
+                chunk_count += 1
+                del buffer[:cut_bytes - overlap_bytes]
+                buffer_start += cut_bytes - overlap_bytes
+                if adaptive:
+                    max_bitrate = max(max_bitrate, len(chunk.getbuffer()) * PCM_BYTES_PER_SECOND / cut_bytes)
+                    chunk_bytes = max_chunk_length(max_bitrate) * PCM_BYTES_PER_SECOND
+            if not block:
+                break
+        
+        process.wait()
+        writer.join()
+        error_reader.join()
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed to decode the audio: {b''.join(errors).decode(errors='replace').strip()}")
+        
+        # Last chunk, unless what is left was already sent as the overlap of the previous one
+        if buffer and (chunk_count == 0 or len(buffer) > overlap_bytes):
+            yield encode_pcm_to_flac(buffer), buffer_start * 1000 // PCM_BYTES_PER_SECOND
+            chunk_count += 1
+        logger.info(f"Audio streamed into {chunk_count} chunks, {(buffer_start + len(buffer)) / PCM_BYTES_PER_SECOND:.2f}s decoded")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        if spool is not None:
+            spool.close()
+
+def _feed_process(stdin, source):
+    """Write bytes or a binary file-like object to a process stdin, block by block."""
+    try:
+        if isinstance(source, (bytes, bytearray)):
+            view = memoryview(source)
+            for start in range(0, len(view), STREAM_BLOCK_SIZE):
+                stdin.write(view[start:start + STREAM_BLOCK_SIZE])
+        else:
+            while True:
+                block = source.read(STREAM_BLOCK_SIZE)
+                if not block:
+                    break
+                stdin.write(block)
+    except (BrokenPipeError, ValueError):
+        # ffmpeg exited early, its return code tells why
+        pass
+    except Exception as e:
+        logger.error(f"Error feeding ffmpeg: {e}")
+    finally:
+        try:
+            stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+
+def encode_pcm_to_flac(pcm):
+    """Encode 16kHz mono 16-bit PCM to an in-memory FLAC file."""
+    command = [
+        'ffmpeg', '-v', 'error',
+        '-f', 's16le', '-ar', str(SAMPLE_RATE), '-ac', '1', '-i', 'pipe:0',
+        '-acodec', 'flac', '-f', 'flac', 'pipe:1'
+    ]
+    result = subprocess.run(command, input=bytes(pcm), capture_output=True, check=True)
+    # ffmpeg cannot rewrite the sample count in the header of a piped output, set it ourselves
+    flac = set_flac_total_samples(result.stdout, len(pcm) // 2)
+    return io.BytesIO(flac)
+
+def set_flac_total_samples(flac, total_samples):
+    """Return a copy of FLAC data with the total number of samples set in its STREAMINFO block."""
+    flac = bytearray(flac)
+    if flac[:4] != b'fLaC' or flac[4] & 0x7F != 0:
+        raise ValueError('FLAC data does not start with a STREAMINFO block')
+    # Sample rate (20 bits), channels (3), bits per sample (5) and total samples (36) are packed in bytes 18 to 26
+    packed = int.from_bytes(flac[18:26], 'big')
+    packed = (packed & ~((1 << 36) - 1)) | (total_samples & ((1 << 36) - 1))
+    flac[18:26] = packed.to_bytes(8, 'big')
+    return bytes(flac)
+
+
 # ******************************************** Using filesystem ************************************************
 
 def generate_new_filename(file_path, new_extension):
@@ -138,6 +373,50 @@ def preprocess_audio_filesystem(file_path, logger=logger):
         return None
     
     
+def preprocess_audio_stream_filesystem(stream, file_name, logger=logger):
+    """Decode a streamed upload straight into a 16kHz mono FLAC file, without saving the original.
+
+    Args:
+        stream (file-like): binary stream of the uploaded file, e.g. an S3 StreamingBody.
+        file_name (str): name of the uploaded file.
+
+    Returns:
+        str: path of the processed FLAC file in VIDEO_FOLDER, None on failure.
+    """
+    try:
+        file_type = file_name.split('.')[-1]
+        logger.info(f"Processing stream of file: {file_name} with type: {file_type}")
+        processed_audio_path = generate_new_filename(os.path.join(Config.VIDEO_FOLDER, os.path.basename(file_name)), 'flac')
+        
+        # The cache protocol lets ffmpeg seek back in a piped MP4 whose index is at the end
+        input_url = 'cache:pipe:0' if file_type in SEEKABLE_INPUT_TYPES else 'pipe:0'
+        command = [
+            'ffmpeg', '-v', 'error', '-y', '-i', input_url,
+            '-vn',                                   # Disable video recording
+            '-ar', str(SAMPLE_RATE),                 # Set audio sample rate to 16kHz
+            '-ac', '1',                              # Set audio to mono (1 channel)
+            '-acodec', 'flac',                       # Output as FLAC codec
+            processed_audio_path                     # Output audio file
+        ]
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        writer = threading.Thread(target=_feed_process, args=(process.stdin, stream), daemon=True)
+        writer.start()
+        errors = process.stderr.read()
+        process.wait()
+        writer.join()
+        if process.returncode != 0:
+            if os.path.exists(processed_audio_path):
+                os.remove(processed_audio_path)
+            raise RuntimeError(f"ffmpeg failed to decode the audio: {errors.decode(errors='replace').strip()}")
+        
+        logger.info(f"Audio stream decoded and preprocessed: {processed_audio_path}")
+        return processed_audio_path
+    
+    except Exception as e:
+        logger.error(f"Error extracting and preprocessing audio stream: {e}")
+        return None
+    
+    
 def bytes_to_int(bytes: list) -> int:
     """Convert a list of bytes to an integer."""
     result = 0
@@ -145,70 +424,124 @@ def bytes_to_int(bytes: list) -> int:
         result = (result << 8) + byte
     return result
 
-def get_flac_duration(filename: str) -> float:
-    """Returns the duration of a FLAC file in seconds by reading its metadata."""
+def get_flac_duration(filename) -> float:
+    """Returns the duration of a FLAC file in seconds by reading its metadata.
+
+    Accepts a path or a binary file-like object, whose position is restored afterwards.
+    """
     try:
+        if hasattr(filename, 'read'):
+            position = filename.tell()
+            try:
+                return _read_flac_duration(filename)
+            finally:
+                filename.seek(position)
         with open(filename, 'rb') as f:
-            if f.read(4) != b'fLaC':
-                raise ValueError('File is not a FLAC file')
+            return _read_flac_duration(f)
+    except Exception as e:
+        logger.error(f"Error reading FLAC metadata: {e}")
+        return None
 
-            while True:
-                header = f.read(4)
-                if not header:
-                    break  # End of file
+def _read_flac_duration(f):
+    """Read the duration from the STREAMINFO block of an open FLAC file."""
+    if f.read(4) != b'fLaC':
+        raise ValueError('File is not a FLAC file')
 
-                meta = struct.unpack('4B', header)  # Read 4 bytes
-                block_type = meta[0] & 0x7F  # 0111 1111
-                size = bytes_to_int(header[1:4])
+    while True:
+        header = f.read(4)
+        if not header:
+            break  # End of file
 
-                if block_type == 0:  # Metadata Streaminfo block
-                    streaminfo_header = f.read(size)
-                    unpacked = struct.unpack('2H3p3p8B16p', streaminfo_header)
+        meta = struct.unpack('4B', header)  # Read 4 bytes
+        block_type = meta[0] & 0x7F  # 0111 1111
+        size = bytes_to_int(header[1:4])
 
-                    samplerate = bytes_to_int(unpacked[4:7]) >> 4
-                    sample_bytes = [(unpacked[7] & 0x0F)] + list(unpacked[8:12])
-                    total_samples = bytes_to_int(sample_bytes)
+        if block_type == 0:  # Metadata Streaminfo block
+            streaminfo_header = f.read(size)
+            unpacked = struct.unpack('2H3p3p8B16p', streaminfo_header)
 
-                    return float(total_samples) / samplerate
+            samplerate = bytes_to_int(unpacked[4:7]) >> 4
+            sample_bytes = [(unpacked[7] & 0x0F)] + list(unpacked[8:12])
+            total_samples = bytes_to_int(sample_bytes)
 
-        logger.error("No Streaminfo block found in FLAC file.")
-        return None
-    except Exception as e:
-        logger.error(f"Error reading FLAC metadata: {e}")
-        return None
+            return float(total_samples) / samplerate
+
+    logger.error("No Streaminfo block found in FLAC file.")
+    return None
     
     
-def split_audio_into_chunks_filesystem(file_path, chunk_length=600, overlap=Config.GROQ_OVERLAP_TIME):
-    """Split audio into chunks with overlap using temporary files, avoiding high memory usage."""
+def compute_file_energies(file_path):
+    """Energy profile of an audio file, decoded block by block by ffmpeg to 16kHz mono PCM."""
+    command = [
+        'ffmpeg', '-v', 'error', '-i', file_path,
+        '-ar', str(SAMPLE_RATE), '-ac', '1', '-f', 's16le', 'pipe:1'
+    ]
+    frame_bytes = int(FRAME_SECONDS * PCM_BYTES_PER_SECOND)
+    block_size = STREAM_BLOCK_SIZE - STREAM_BLOCK_SIZE % frame_bytes
+    energies = []
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        pending = b''
+        while True:
+            block = process.stdout.read(block_size)
+            if not block:
+                break
+            block = pending + block
+            usable = len(block) - len(block) % frame_bytes
+            energies.append(frame_energies(block[:usable], SAMPLE_RATE))
+            pending = block[usable:]
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to decode {file_path}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+    return np.concatenate(energies) if energies else np.zeros(0, dtype=np.float32)
+
+def split_audio_into_chunks_filesystem(file_path, plan=None, max_outputs_per_pass=Config.FFMPEG_MAX_OUTPUTS_PER_PASS):
+    """Split audio into chunks with overlap using temporary files, avoiding high memory usage.
+
+    The file is decoded once for a whole batch of chunks: every chunk is a separate ffmpeg output
+    trimmed with -ss/-t, so overlapping chunks are cut in a single pass. When there are more chunks
+    than max_outputs_per_pass, each further batch seeks on the input side to its first chunk.
+    Without a plan, one is computed from the size, duration and energy profile of the file.
+
+    Returns:
+        list: (chunk file path, offset) pairs, offset being the start of the chunk in milliseconds.
+            A file small enough for a single request is returned as its only chunk.
+    """
+    chunks = []
     try:
         
-        duration = get_flac_duration(file_path)
-        if duration is None:
-            logger.error("Cannot estimate duration, splitting failed")
-            return None
-        
-        chunks = []
-
-        # Loop to split the file
-        for start in range(0, int(duration), chunk_length - overlap):
-            end = min(start + chunk_length, int(duration))
-
-            # Create a temporary file for each chunk
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.flac') as temp_chunk_file:
-                temp_chunk_filename = temp_chunk_file.name
-                
-                # Use ffmpeg to extract the chunk directly into the temporary file
-                command = [
-                    'ffmpeg', '-i', file_path, 
-                    '-vn', '-acodec', 'flac', 
-                    '-ss', str(start), '-to', str(end),
-                    '-y',
-                    temp_chunk_filename
+        if plan is None:
+            duration = get_flac_duration(file_path)
+            if duration is None:
+                logger.error("Cannot estimate duration, splitting failed")
+                return None
+            energies = None
+            if SILENCE_SEARCH_WINDOW and duration > max_chunk_length(os.path.getsize(file_path) / max(duration, 1)):
+                energies = compute_file_energies(file_path)
+            plan = plan_chunks(duration, os.path.getsize(file_path), energies)
+        if plan.is_single_request():
+            logger.info(f"{file_path} fits in a single request, not split")
+            return [(file_path, 0)]
+        
+        boundaries = plan.boundaries
+        for batch_start in range(0, len(boundaries), max_outputs_per_pass):
+            batch = boundaries[batch_start:batch_start + max_outputs_per_pass]
+            seek = batch[0][0]
+            command = ['ffmpeg', '-v', 'error', '-y', '-ss', f"{seek:.3f}", '-i', file_path]
+            for (start, end), offset in zip(batch, plan.offsets[batch_start:]):
+                # Create a temporary file for each chunk
+                with tempfile.NamedTemporaryFile(delete=False, suffix='.flac') as temp_chunk_file:
+                    chunks.append((temp_chunk_file.name, offset))
+                command += [
+                    '-map', '0:a', '-vn', '-acodec', 'flac',
+                    '-ss', f"{start - seek:.3f}", '-t', f"{end - start:.3f}",
+                    temp_chunk_file.name
                 ]
-                subprocess.run(command, check=True)
-                
-                # Append the chunk file path to the list
-                chunks.append(temp_chunk_filename)
+            subprocess.run(command, check=True)
+            logger.info(f"Chunks {batch_start + 1} to {batch_start + len(batch)} of {len(boundaries)} written")
         
         os.remove(file_path)
         logger.info(f"Original file deleted: {file_path}")
@@ -216,4 +549,7 @@ def split_audio_into_chunks_filesystem(file_path, chunk_length=600, overlap=Conf
 
     except Exception as e:
         logger.error(f"Error splitting audio: {e}")
-        return None
\ No newline at end of file
+        for chunk_path, _ in chunks:
+            if os.path.exists(chunk_path):
+                os.remove(chunk_path)
+        return None
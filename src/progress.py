@@ -0,0 +1,97 @@
+import threading
+import time
+from config import Config
+
+# Progress trackers by key: the uploaded filename while uploading, then the job id (timestamped filename)
+_trackers = {}
+_trackers_lock = threading.Lock()
+_latest_tracker = None
+
+
+class ProgressTracker:
+    """Progress and current step of one upload or transcription job.
+
+    Every update bumps a version number and wakes up the threads waiting in wait_for_update,
+    which is what the Server-Sent Events stream is built on.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.progress = 0
+        self.step = "Starting..."
+        self.failed = False
+        self.last_sent_progress = 0  # last progress returned by the polling endpoint
+        self.version = 0
+        self.updated_at = time.time()
+        self._condition = threading.Condition()
+
+    def update(self, progress, step):
+        """Set the progress percentage and the step description."""
+        global _latest_tracker
+        with self._condition:
+            self.progress = progress
+            self.step = step
+            self.version += 1
+            self.updated_at = time.time()
+            self._condition.notify_all()
+        _latest_tracker = self
+
+    def set_step(self, step):
+        """Change the step description without moving the progress."""
+        self.update(self.progress, step)
+
+    def fail(self, step):
+        """Mark the job as failed with an error description."""
+        global _latest_tracker
+        with self._condition:
+            self.failed = True
+            self.step = step
+            self.version += 1
+            self.updated_at = time.time()
+            self._condition.notify_all()
+        _latest_tracker = self
+
+    def is_finished(self):
+        return self.failed or self.progress >= 100
+
+    def snapshot(self):
+        if self.failed:
+            return {"progress": self.progress, "error": self.step}
+        return {"progress": self.progress, "step": self.step}
+
+    def wait_for_update(self, version, timeout=None):
+        """Wait until the tracker moves past the given version.
+
+        Returns:
+            dict: snapshot of the tracker.
+            int: its version, equal to the given one if nothing changed before the timeout.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.version != version, timeout)
+            return self.snapshot(), self.version
+
+
+def get_tracker(key):
+    """Return the tracker of key, creating it if needed."""
+    with _trackers_lock:
+        tracker = _trackers.get(key)
+        if tracker is None:
+            tracker = _trackers[key] = ProgressTracker(key)
+        return tracker
+
+def find_tracker(key):
+    """Return the tracker of key, or None if there is none."""
+    with _trackers_lock:
+        return _trackers.get(key)
+
+def latest_tracker():
+    """Return the most recently updated tracker, for clients that do not send a job id."""
+    return _latest_tracker
+
+def cleanup_trackers(expiry=Config.JOB_RETENTION):
+    """Forget trackers not updated for expiry seconds."""
+    now = time.time()
+    with _trackers_lock:
+        expired = [key for key, tracker in _trackers.items() if now - tracker.updated_at > expiry]
+        for key in expired:
+            del _trackers[key]
@@ -0,0 +1,158 @@
+import logging
+import random
+import re
+import threading
+import time
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Rate limit budgets tracked from the provider headers (x-ratelimit-remaining-<budget>, ...)
+REQUESTS_BUDGET = "requests"
+AUDIO_SECONDS_BUDGET = "audio-seconds"
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+
+def parse_duration(value):
+    """Parse a rate limit duration header ('2m59.56s', '7.66s', '120ms', '30') into seconds.
+
+    Returns None if the value cannot be parsed.
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    units = {'h': 3600.0, 'm': 60.0, 's': 1.0, 'ms': 0.001}
+    return sum(float(amount) * units[unit] for amount, unit in parts)
+
+
+class TokenBucket:
+    """Token bucket refilled continuously up to its capacity.
+
+    Args:
+        capacity (float): maximum number of tokens.
+        refill_rate (float): tokens added per second.
+    """
+
+    def __init__(self, capacity, refill_rate):
+        self.capacity = float(capacity)
+        self.refill_rate = float(refill_rate)
+        self.tokens = float(capacity)
+        self.blocked_until = 0.0
+        self._last_refill = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._last_refill) * self.refill_rate)
+        self._last_refill = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount tokens are available, 0 if they are available now."""
+        amount = min(amount, self.capacity)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < amount:
+            wait = max(wait, (amount - self.tokens) / self.refill_rate)
+        return wait
+
+    def consume(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+    def sync(self, remaining, reset_after, now):
+        """Align the bucket with the budget reported by the provider.
+
+        The provider budget may cover another window than the bucket (e.g. requests per day
+        for a bucket refilled per minute): its remainder only lowers the tokens, and once it
+        is spent the bucket is blocked until the budget resets.
+        """
+        if remaining is not None:
+            self.tokens = min(self.tokens, remaining)
+        if remaining is not None and remaining <= 0 and reset_after:
+            self.blocked_until = max(self.blocked_until, now + reset_after)
+
+
+class RateLimitScheduler:
+    """Shared scheduler handing out send slots to every thread calling the provider.
+
+    Requests and audio seconds are both budgeted with token buckets sized from the configured
+    per-minute and per-hour limits, and capped by the x-ratelimit-* response headers. A 429 pauses every sender until Retry-After,
+    then each one retries after a jittered exponential backoff, up to max_retries times.
+    """
+
+    def __init__(self, requests_per_minute=Config.GROQ_REQUESTS_PER_MINUTE,
+                 audio_seconds_per_hour=Config.GROQ_AUDIO_SECONDS_PER_HOUR,
+                 max_retries=Config.GROQ_MAX_RETRIES, base_delay=Config.GROQ_RETRY_BASE_DELAY,
+                 max_delay=Config.GROQ_RETRY_MAX_DELAY, logger=logger):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.logger = logger
+        self._buckets = {
+            REQUESTS_BUDGET: TokenBucket(requests_per_minute, requests_per_minute / 60.0),
+            AUDIO_SECONDS_BUDGET: TokenBucket(audio_seconds_per_hour, audio_seconds_per_hour / 3600.0),
+        }
+        self._paused_until = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self, audio_seconds=0):
+        """Block until a request of audio_seconds can be sent, then take it from the budgets."""
+        needs = {REQUESTS_BUDGET: 1, AUDIO_SECONDS_BUDGET: audio_seconds}
+        waited = 0.0
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                wait = max(0.0, self._paused_until - now)
+                for name, bucket in self._buckets.items():
+                    bucket.refill(now)
+                    wait = max(wait, bucket.wait_time(needs[name], now))
+                if wait <= 0:
+                    for name, bucket in self._buckets.items():
+                        bucket.consume(needs[name])
+                    break
+                # Woken up early when the provider reports a fresher budget
+                self._condition.wait(wait)
+                waited += time.monotonic() - now
+        if waited > 1:
+            self.logger.info(f"Waited {waited:.2f}s for a send slot")
+        return waited
+
+    def update_from_headers(self, headers):
+        """Sync the budgets with the x-ratelimit-* headers of a provider response."""
+        if not headers:
+            return
+        with self._condition:
+            now = time.monotonic()
+            for name, bucket in self._buckets.items():
+                # x-ratelimit-limit-* is not used: its window (per day for requests) is not the one of the bucket
+                remaining = headers.get(f"x-ratelimit-remaining-{name}")
+                reset_after = parse_duration(headers.get(f"x-ratelimit-reset-{name}"))
+                try:
+                    remaining = float(remaining) if remaining is not None else None
+                except ValueError:
+                    continue
+                bucket.refill(now)
+                bucket.sync(remaining, reset_after, now)
+            self._condition.notify_all()
+
+    def on_rate_limited(self, headers, attempt):
+        """Pause every sender after a 429 and return the backoff delay of the caller."""
+        retry_after = parse_duration(headers.get("retry-after")) if headers else None
+        self.update_from_headers(headers)
+        with self._condition:
+            if retry_after:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            self._condition.notify_all()
+        self.logger.warning(f"Rate limited by the provider, retry-after: {retry_after}, attempt: {attempt + 1}")
+        return self.backoff_delay(attempt)
+
+    def backoff_delay(self, attempt):
+        """Exponential backoff with full jitter, so retries do not hit the provider at once."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+# Process-wide scheduler shared by every job
+rate_limit_scheduler = RateLimitScheduler()
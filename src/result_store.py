@@ -0,0 +1,172 @@
+import json
+import math
+import logging
+import os
+import sqlite3
+import threading
+import time
+from config import Config
+from src.scheduler import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+# Namespaces of the entries
+JOB_STATUS = "job"
+TRANSCRIPTION_RESULT = "result"
+
+# ********************************************* Backends *********************************************
+class MemoryStore:
+    """Job statuses and results in the memory of the process, for a single worker."""
+
+    shared = False  # each process keeps and cleans up its own entries
+
+    def __init__(self, ttl = Config.RESULT_STORE_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def put(self, namespace, key, value, ttl = None):
+        with self._lock:
+            self._entries[(namespace, key)] = (time.time() + (ttl or self.ttl), value)
+
+    def get(self, namespace, key):
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._entries[(namespace, key)]
+                return None
+            return entry[1]
+
+    def pop(self, namespace, key):
+        """Return and delete an entry, so only one caller gets it."""
+        with self._lock:
+            entry = self._entries.pop((namespace, key), None)
+        if entry is None or entry[0] < time.time():
+            return None
+        return entry[1]
+
+    def cleanup(self):
+        now = time.time()
+        with self._lock:
+            expired = [key for key, (expires_at, _) in self._entries.items() if expires_at < now]
+            for key in expired:
+                del self._entries[key]
+
+
+class SQLiteStore:
+    """Job statuses and results in a SQLite file, shared by the workers of a host or a shared volume."""
+
+    shared = True
+
+    def __init__(self, path = Config.RESULT_STORE_PATH, ttl = Config.RESULT_STORE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+
+    def _connection(self):
+        """Connection of the calling thread, sqlite3 connections cannot be shared between threads."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")  # readers do not block the writer
+            self._local.connection = connection
+        return connection
+
+    def put(self, namespace, key, value, ttl = None):
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value, default=str), time.time() + (ttl or self.ttl))
+            )
+
+    def get(self, namespace, key):
+        row = self._connection().execute(
+            "SELECT value FROM entries WHERE namespace = ? AND key = ? AND expires_at >= ?",
+            (namespace, key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def pop(self, namespace, key):
+        """Return and delete an entry, so only one caller gets it, even in another process."""
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")  # lock out other writers until the delete
+            row = connection.execute(
+                "SELECT value, expires_at FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+        return json.loads(row[0]) if row[1] >= time.time() else None
+
+    def cleanup(self):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM entries WHERE expires_at < ?", (time.time(),))
+
+
+class RedisStore:
+    """Job statuses and results in Redis, shared by every task of the service.
+
+    Args:
+        client: redis client, built from url when not given (any object with the
+            get/set/delete/pipeline subset of redis-py, e.g. a fakeredis client).
+    """
+
+    shared = True
+
+    def __init__(self, url = Config.RESULT_STORE_REDIS_URL, ttl = Config.RESULT_STORE_TTL, client = None,
+                 prefix = "mcc-transcript:"):
+        if client is None:
+            import redis  # optional dependency, only needed with this backend
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, namespace, key):
+        return f"{self.prefix}{namespace}:{key}"
+
+    def put(self, namespace, key, value, ttl = None):
+        # Redis expires keys after whole seconds, at least one
+        self.client.set(self._key(namespace, key), json.dumps(value, default=str), ex=max(1, math.ceil(ttl or self.ttl)))
+
+    def get(self, namespace, key):
+        value = self.client.get(self._key(namespace, key))
+        return json.loads(value) if value is not None else None
+
+    def pop(self, namespace, key):
+        """Return and delete an entry atomically, so only one caller gets it."""
+        pipeline = self.client.pipeline()
+        pipeline.get(self._key(namespace, key))
+        pipeline.delete(self._key(namespace, key))
+        value, _ = pipeline.execute()
+        return json.loads(value) if value is not None else None
+
+    def cleanup(self):
+        pass  # keys expire on their own
+
+
+def create_result_store(backend = Config.RESULT_STORE_BACKEND, logger = logger):
+    """Return the job and result store selected in the configuration."""
+    if backend == "sqlite":
+        return SQLiteStore()
+    if backend == "redis":
+        return RedisStore()
+    if backend != "memory":
+        logger.error(f"Unknown result store backend: {backend}, results kept in memory")
+    return MemoryStore()
+
+result_store = create_result_store()
+
+# Deletion of the expired entries
+store_cleanup_task = PeriodicTask(result_store.cleanup, Config.RESULT_STORE_CLEANUP_INTERVAL, name="result-store-cleanup",
+                                  run_at_start=False)
@@ -2,46 +2,41 @@ import os
 from datetime import datetime
 import time
 import logging
-from src.file_utils import save_transcription
-from src.process_audio import (extract_audio, preprocess_audio, split_audio_into_chunks, 
-                                preprocess_audio_filesystem, split_audio_into_chunks_filesystem)
+from src.file_utils import save_transcription, ensure_docx
+from src.process_audio import (extract_audio, preprocess_audio, split_audio_into_chunks, stream_audio_into_chunks,
+                                preprocess_audio_filesystem, preprocess_audio_stream_filesystem,
+                                split_audio_into_chunks_filesystem, SourceSpool)
+from src.chunk_planner import chunking_signature
 from src.merge_transcription import merge_transcriptions
 from flask import request, jsonify, send_file, Response, stream_with_context
 from app import app
 from src.client import (initialize_client, transcribe_openai, transcribe_groq, 
-                        Transcribe_WithGroq_SingleChunk, GenerateSRTFromGroq)
-from config import (Config, read_log_file) 
+                        Transcribe_WithGroq_SingleChunk, Transcribe_Chunks_Concurrently)
+from config import Config
+from src.log_tail import read_log_tail, follow_log, parse_level, format_record_html
+from src.jobs import job_manager, current_job, JobQueueFull, JobNotRetryable, DuplicateJob
+from src.result_store import result_store, TRANSCRIPTION_RESULT
+from src.metrics import time_stage, observe_stage, render_metrics, TimedIterator
+from src.chunk_journal import open_chunk_journal, make_journal_key
 
 from src.s3Bucket import (check_file_exists, upload_to_s3, delete_file_from_s3, 
                             list_files_in_s3, open_from_s3, generate_presigned_url_GET, 
                             generate_presigned_url_POST, get_all_fileNames_in_s3,
-                            download_from_s3, Delete_Old_Files_From_S3)
-import requests
+                            download_from_s3, open_stream_from_s3, get_object_fingerprint, object_exists)
+from src.transcription_cache import (transcription_cache, make_cache_key, hash_bytes, hash_file,
+                                     DigestingChunks)
+from src.subtitles import render_subtitles
+from src.progress import get_tracker, find_tracker, latest_tracker, cleanup_trackers
 import threading
+import json
+import html
+from urllib.parse import urlencode
 
 logger = logging.getLogger(__name__)
 
-# Global variable to track the last cleanup time
-last_cleanup_time = 0
-
-# Global dictionary to store responses with timestamps
-transcription_responses = {}
-RESPONSE_EXPIRY_SECONDS = 3600  # 1 hour
-
-# Global variable to track the last cleanup time for transcription responses
+# Global variable to track the last cleanup time for the progress trackers
 last_transcription_cleanup_time = 0
 
-def cleanup_transcription_responses():
-    """Clean up expired entries in transcription_responses."""
-    global transcription_responses
-    current_time = time.time()
-    keys_to_delete = [
-        key for key, value in transcription_responses.items()
-        if current_time - value['timestamp'] > RESPONSE_EXPIRY_SECONDS
-    ]
-    for key in keys_to_delete:
-        del transcription_responses[key]
-
 # ******************************************** Test Routes ************************************************
 @app.route('/')
 def home():
@@ -49,7 +44,47 @@ def home():
 
 @app.route('/logs')
 def logs():
-    logs = read_log_file()
+    """Last records of the log file, as a page or JSON (format=json), or followed with Server-Sent Events (follow=true)
+
+    Query parameters: limit, level (minimum level), job_id, before (cursor of the previous page),
+    after (cursor where a follow stream starts, the end of the file by default)
+    """
+    try:
+        limit = max(1, min(int(request.args.get('limit', Config.LOG_TAIL_LINES)), Config.LOG_TAIL_MAX_LINES))
+        min_level = parse_level(request.args.get('level'))
+        before = request.args.get('before')
+        before = int(before) if before else None
+        after = request.headers.get('Last-Event-ID') or request.args.get('after')
+        after = int(after) if after else None
+    except ValueError as e:
+        return jsonify({'error': 'Invalid log query', 'details': str(e)}), 400
+    job_id = request.args.get('job_id') or None
+
+    try:
+        if request.args.get('follow') == 'true':
+            def generate():
+                for record in follow_log(after=after, min_level=min_level, job_id=job_id):
+                    if record is None:
+                        # Comment line to keep proxies from closing an idle connection
+                        yield ": keep-alive\n\n"
+                        continue
+                    yield f"id: {record['next']}\ndata: {json.dumps(record)}\n\n"
+
+            return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+        records, cursor, end = read_log_tail(limit=limit, min_level=min_level, job_id=job_id, before=before)
+    except OSError as e:
+        logger.error(f"Error reading log file {Config.LOG_FILE}: {e}")
+        return jsonify({'error': 'Cannot read the log file', 'details': str(e)}), 500
+    if request.args.get('format') == 'json':
+        return jsonify({'records': records, 'before': cursor, 'after': end}), 200
+
+    formatted_logs = '<br>'.join(format_record_html(record) for record in records)
+    older = ""
+    if cursor is not None:
+        query = {key: value for key, value in request.args.items() if key != 'before'}
+        older = f'<p><a href="?{html.escape(urlencode({**query, "before": cursor}))}">Older logs</a></p>'
     # Directly embed the HTML-formatted logs into the page
     return f"""
     <html>
@@ -75,7 +110,8 @@ def logs():
         </head>
         <body>
             <h1>Application Logs</h1>
-            <div class="log">{logs}</div>
+            {older}
+            <div class="log">{formatted_logs}</div>
         </body>
     </html>
     """
@@ -136,6 +172,7 @@ def test_presigned_url():
     
     post_url = generate_presigned_url_POST(file_name, file_size, expires_in=60)
     files = {'file': (open(file_path, 'rb'))}
+    import requests  # only used by this test route
     response = requests.post(post_url['url'],data=post_url['fields'], files=files)
     
     return f"Response: {response.text}"
@@ -153,44 +190,71 @@ def test_presigned_url_GET():
     return jsonify({'presigned_url': presigned_url})
 
 # ******************************************** progess Routes ************************************************
-progress = 0
-step = "Starting..."
-last_sent_progress = 0
 @app.route('/api/progress', methods=['GET'])
 def get_progress():
-    global progress
-    global step
-    global last_sent_progress
-    if progress == -1:
-        return jsonify({"progress": last_sent_progress, "error": step}), 569        
-    if progress != last_sent_progress:  # Only send if there's an update
-        last_sent_progress = progress
-        return jsonify({"progress": progress, "step": step}), 200   
+    """Poll the progress of a job, 204 when it did not change since the last poll"""
+    job_id = request.args.get('job_id') or request.args.get('timestamped_filename')
+    # Clients that do not send a job id get the most recently updated job
+    tracker = find_tracker(job_id) if job_id else latest_tracker()
+    if tracker is None:
+        if job_id:
+            return jsonify({'error': 'No progress found for the provided job id'}), 404
+        return "", 204
+    if tracker.failed:
+        return jsonify({"progress": tracker.last_sent_progress, "error": tracker.step}), 569        
+    if tracker.progress != tracker.last_sent_progress:  # Only send if there's an update
+        tracker.last_sent_progress = tracker.progress
+        return jsonify({"progress": tracker.progress, "step": tracker.step}), 200   
     return "", 204  # No content if progress hasn't changed
 
+@app.route('/api/progress/stream/<job_id>', methods=['GET'])
+def stream_progress(job_id):
+    """Push the progress of a job with Server-Sent Events until it completes or fails.
+
+    The stream is closed after SSE_MAX_DURATION seconds, the EventSource reconnects and gets the current progress.
+    """
+    tracker = find_tracker(job_id)
+    if tracker is None:
+        return jsonify({'error': 'No progress found for the provided job id'}), 404
+
+    def generate():
+        version = None
+        deadline = time.monotonic() + Config.SSE_MAX_DURATION
+        while time.monotonic() < deadline:
+            timeout = min(Config.SSE_KEEPALIVE_INTERVAL, deadline - time.monotonic())
+            snapshot, new_version = tracker.wait_for_update(version, timeout=timeout)
+            if new_version == version:
+                # Comment line to keep proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+                continue
+            version = new_version
+            event = "error" if tracker.failed else "progress"
+            yield f"event: {event}\ndata: {json.dumps(snapshot)}\n\n"
+            if tracker.is_finished():
+                break
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # ******************************************** Main Routes ************************************************
 
 @app.route('/api/upload', methods=['POST'])
 def upload():
     """ Handle file upload """
-    global progress
-    global step
-    progress = 0
-    step = "Starting upload..."
     try:
         data = request.get_json()
         filename = data.get('filename')
         filesize = data.get('filesize')
+        tracker = get_tracker(filename)
+        tracker.update(0, "Starting upload...")
         
         logger.info(f"Received file upload request: {data}")
 
-        progress = 2
-        step = "Generating presigned URL..."
+        tracker.update(2, "Generating presigned URL...")
         # Generate presigned URL for the file
         presigned_url = generate_presigned_url_POST(filename, filesize, expires_in=10)  # Increase expiration time if needed
 
-        progress = 5
-        step = "Uploading the document..."
+        tracker.update(5, "Uploading the document...")
         logger.info(f"Presigned URL generated: {presigned_url}")
         
         if "already_exists" in presigned_url:
@@ -204,23 +268,17 @@ def upload():
 
 @app.route('/api/transcribe', methods=['POST'])
 def transcribe():
-    """ Transcribe audio file """
-    global progress
-    global step
-    global last_cleanup_time
+    """ Queue the transcription of an audio file """
     global last_transcription_cleanup_time
-    global transcription_responses
 
     # Perform cleanup if it hasn't been done in the last hour
     current_time = time.time()
     if current_time - last_transcription_cleanup_time > 3600:  # 1 hour
-        logger.info("Performing cleanup of expired transcription responses.")
-        cleanup_transcription_responses()
+        logger.info("Performing cleanup of expired progress trackers.")
+        cleanup_trackers()
         last_transcription_cleanup_time = current_time
 
-    progress = 15
-    step = "Document uploaded"
-    client = initialize_client()
+    filename = None
     try:
         data = request.get_json()
         filename = data.get('filename')
@@ -229,6 +287,8 @@ def transcribe():
 
         if not filename:
             return jsonify({'error': 'No filename provided'}), 400
+        tracker = get_tracker(filename)
+        tracker.update(15, "Document uploaded")
         if not language:
             return jsonify({'error': 'No language selected'}), 400
         if not translation_language:
@@ -239,10 +299,11 @@ def transcribe():
 
         file_path = filename  # TODO add config folder once
         
-        step = "Checking if the document is correctly uploaded..."
+        tracker.set_step("Checking if the document is correctly uploaded...")
         # check for file path in s3 bucket
         fileExist, _ = check_file_exists(file_path, 1000)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        # Microseconds keep the names, and the job ids, of uploads of the same file apart
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
         timestamped_filename = f"{timestamp}-{filename}"
         logger.info(f"Transcribing file: {filename} with timestamped filename: {timestamped_filename}")
         
@@ -250,145 +311,256 @@ def transcribe():
             logger.error(f"File not found at path: {file_path}")
             return jsonify({'error': 'File not found'}), 404
 
-        # Return early with the timestamped filename to avoid timeout
-        return jsonify({'success': True, 'timestamped_filename': timestamped_filename}), 200
+        # Run the transcription in the background and return right away
+        get_tracker(timestamped_filename).update(15, "Waiting for a transcription worker...")
+        job = job_manager.submit(process_transcription, filename, file_path, language, timestamped_filename,
+                                 job_id=timestamped_filename)
+        return jsonify({'success': True, 'timestamped_filename': timestamped_filename, 'job_id': job.id}), 200
+    except JobQueueFull as e:
+        logger.error(f"Cannot queue transcription of {filename}: {e}")
+        return jsonify({'error': 'Too many transcriptions in progress', 'details': str(e),
+                        'queue': job_manager.stats()}), 503
+    except DuplicateJob as e:
+        logger.error(f"Cannot queue transcription of {filename}: {e}")
+        return jsonify({'error': 'Transcription already in progress', 'details': str(e)}), 409
     except Exception as e:
         logger.error(f"Error launching transcription of {filename}: {e}")
-    finally:
-        # Do the actual transcription
-        try:
-            if Config.USE_FILE_SYSTEM == "false":
-                # Get File from s3 bucket
+        return jsonify({'error': 'Transcription failed', 'details': str(e)}), 500
+
+def process_transcription(filename, file_path, language, timestamped_filename):
+    """Download, preprocess, transcribe and merge an audio file, then save the results.
+
+    Runs in a job worker thread. Errors are raised so the job ends up failed.
+    """
+
+    tracker = get_tracker(timestamped_filename)
+    client = initialize_client()
+    local_file_path = None
+    local_processed_file_path = None
+    source_stream = None
+    chunks = None
+    final_result = None
+    cache_keys = []  # keys the merged result is cached under
+    fingerprint = None
+    journal = None
+    try:
+        job = current_job()
+        if job is not None and job.attempt > 1 and not object_exists(file_path, logger):
+            raise JobNotRetryable(f"Source file {file_path} is no longer in S3")
+        if transcription_cache is not None or Config.CHUNK_JOURNAL_BACKEND != "none":
+            fingerprint = get_object_fingerprint(file_path, logger)
+        if transcription_cache is not None and fingerprint:
+            # Same uploaded object and language: no need to even download it
+            cache_keys.append(make_cache_key('source', fingerprint, language))
+            final_result = transcription_cache.get(cache_keys[-1])
+        if final_result is None and Config.CHUNK_JOURNAL_BACKEND != "none" and fingerprint:
+            # Chunks transcribed by a previous attempt or before a task restart are not sent again
+            journal = open_chunk_journal(make_journal_key(fingerprint, language, chunking_signature()), timestamped_filename,
+                                         logger=logger)
+
+        if final_result is not None:
+            logger.info(f"Cache hit on the uploaded object {file_path}")
+        elif Config.USE_FILE_SYSTEM == "false" and Config.STREAMING_AUDIO_PIPELINE == "true":
+            # Get File from s3 bucket, streamed into the decoder as it downloads
+            if Config.STREAM_FROM_S3 == "true":
+                download_start = time.perf_counter()
+                source_stream, file_type = open_stream_from_s3(file_path, logger)
+                # The download goes on in the background, timed until the last byte is read
+                content = SourceSpool(source_stream, on_done=lambda: observe_stage('download', time.perf_counter() - download_start))
+            else:
+                with time_stage('download'):
+                    content, file_type = open_from_s3(file_path, logger)
+
+            # Decoded by one ffmpeg process and cut into FLAC chunks while the first chunks are transcribed.
+            # Decoding and splitting are timed together as the 'decode' stage, without the waits for a transcription slot
+            tracker.update(20, "Decoding audio...")
+            chunks = TimedIterator(stream_audio_into_chunks(content, file_type, logger=logger), 'decode')
+            if transcription_cache is not None:
+                # The preprocessed audio only exists as chunks, hash them on the way
+                chunks = DigestingChunks(chunks)
+
+        elif Config.USE_FILE_SYSTEM == "false":
+            # Get File from s3 bucket
+            with time_stage('download'):
                 content, file_type = open_from_s3(file_path, logger)
 
-                progress = 20
-                step = "Extracting audio..."
+            tracker.update(20, "Extracting audio...")
+            with time_stage('preprocess'):
                 audio_content = extract_audio(content, file_type, logger)
                 if audio_content is None:
-                    logger.error("Failed to extract audio")
-                    return jsonify({'error': 'Failed to extract audio'}), 500
+                    raise RuntimeError("Failed to extract audio")
 
-                progress = 30
-                step = "Preprocessing audio..."
+                tracker.update(30, "Preprocessing audio...")
                 processed_audio = preprocess_audio(audio_content)
-                progress = 40
-                step = "Splitting audio into chunks..."
-
-                chunks = split_audio_into_chunks(processed_audio)
-
-                results = []
-                total_transcription_time = 0
-
-                progress = 45
-                step = "Transcribing audio..."
-                for i, chunk in enumerate(chunks):
-                    progress = 45 + (i / len(chunks)) * 35
-                    step = f"Transcribing chunk {i + 1} of {len(chunks)}"
-                    
-                    logger.info(f"Transcribing chunk {i + 1} of {len(chunks)}")
-                    result, chunk_time = Transcribe_WithGroq_SingleChunk(client, chunk, i + 1, len(chunks), language)
-                    total_transcription_time += chunk_time
-                    results.append((result, i * (600 - 10) * 1000))
-                    
-            elif Config.USE_FILE_SYSTEM == "true":
-                progress = 20
-                step = "Preprocessing audio..."
-                local_file_path = download_from_s3(file_path, logger)
-                local_processed_file_path = preprocess_audio_filesystem(local_file_path, logger)
-                
-                progress = 40
-                step = "Splitting audio into chunks..."
-                local_chunks = split_audio_into_chunks_filesystem(local_processed_file_path)
-
-                results = []
-                total_transcription_time = 0
-                progress = 45
-                step = "Transcribing audio..."
-
-                for i, chunk_file in enumerate(local_chunks):
-                    progress = 45 + (i / len(local_chunks)) * 35
-                    step = f"Transcribing chunk {i + 1} of {len(local_chunks)}"
-                    
-                    logger.info(f"Transcribing chunk {i + 1} of {len(local_chunks)}")
-                    
-                    # Open the temporary chunk file
-                    with open(chunk_file, 'rb') as chunk:
-                        result, chunk_time = Transcribe_WithGroq_SingleChunk(client, chunk, i + 1, len(local_chunks), language)
-                    
-                    total_transcription_time += chunk_time
-                    results.append((result, i * (600 - 10) * 1000))
-                    
-                    # Clean up the temporary chunk file
-                    os.remove(chunk_file)
+            if transcription_cache is not None:
+                cache_keys.append(make_cache_key('audio', hash_bytes(processed_audio), language))
+                final_result = transcription_cache.get(cache_keys[-1])
+
+            if final_result is None:
+                tracker.update(40, "Splitting audio into chunks...")
+                with time_stage('split'):
+                    chunks = split_audio_into_chunks(processed_audio)
                 
+        elif Config.USE_FILE_SYSTEM == "true":
+            tracker.update(20, "Preprocessing audio...")
+            if Config.STREAM_FROM_S3 == "true":
+                # Decode while downloading, only the preprocessed FLAC is written to disk
+                source_stream, _ = open_stream_from_s3(file_path, logger)
+                with time_stage('preprocess'):  # download included
+                    local_processed_file_path = preprocess_audio_stream_filesystem(source_stream, file_path, logger)
             else:
-                logger.error(f"File system configuration error with USE_FILE_SYSTEM: {Config.USE_FILE_SYSTEM}")
-                progress = -1
-                step = "File system configuration error"
-                return jsonify({'error': 'File system configuration error'}), 500
-
-            progress = 80
-            step = "Merging transcriptions..."
-            # Delete audio_files from s3
-            delete_file_from_s3(file_path, logger)
-            final_result = merge_transcriptions(results)
+                with time_stage('download'):
+                    local_file_path = download_from_s3(file_path, logger)
+                with time_stage('preprocess'):
+                    local_processed_file_path = preprocess_audio_filesystem(local_file_path, logger)
+            if transcription_cache is not None and local_processed_file_path:
+                cache_keys.append(make_cache_key('audio', hash_file(local_processed_file_path), language))
+                final_result = transcription_cache.get(cache_keys[-1])
             
-            progress = 90
-            step = "Generating files..."
-            srt = GenerateSRTFromGroq(final_result['segments'], logger)
-            txt_path, docx_path, srt_path = save_transcription(final_result['text'], timestamped_filename, srt, logger)
+            if final_result is None:
+                tracker.update(40, "Splitting audio into chunks...")
+                # Temporary chunk files are deleted once transcribed
+                with time_stage('split'):
+                    chunks = split_audio_into_chunks_filesystem(local_processed_file_path)
+                if chunks is None:
+                    raise RuntimeError("Failed to split audio into chunks")
             
-            progress = 100
-            step = "Transcription complete !"
-
-            # Save the response in the global dictionary with a timestamp
-            transcription_responses[timestamped_filename] = {
-                'success': True,
-                'filename': filename,
-                'transcription': final_result['text'],
-                'txt': os.path.basename(txt_path),
-                'word_doc': os.path.basename(docx_path),
-                'srt': os.path.basename(srt_path) if srt_path else None,
-                'timestamp': time.time()  # Add timestamp for cleanup
-            }
-
-            # cleanup the file from s3 if did not already do it within the last hour
-            current_time = time.time()
-            if current_time - last_cleanup_time > 3600:  # 3600 seconds = 1 hour
-                Delete_Old_Files_From_S3()
-                last_cleanup_time = current_time  
-                
-            # Clean up any leftover files in VIDEO_FOLDER
-            logger.info("Cleaning up leftover files in VIDEO_FOLDER")
-            if Config.USE_FILE_SYSTEM == "true" and os.path.exists(Config.VIDEO_FOLDER):
-                for file in os.listdir(Config.VIDEO_FOLDER):
-                    file_path = os.path.join(Config.VIDEO_FOLDER, file)
-                    try:
-                        os.remove(file_path)
-                        logger.info(f"Deleted leftover file: {file_path}")
-                    except Exception as cleanup_error:
-                        logger.error(f"Failed to delete leftover file {file_path}: {cleanup_error}")
-                
-        except Exception as e:
-            progress = -1 
-            step = f"transcription failed: {str(e)}"
-            logger.error(f"Error during transcription of {filename}: {e}")
-            return jsonify({'error': 'Transcription failed', 'details': str(e)}), 500
+        else:
+            raise RuntimeError(f"File system configuration error with USE_FILE_SYSTEM: {Config.USE_FILE_SYSTEM}")
+
+        if final_result is not None:
+            logger.info(f"Transcription of {filename} found in cache, skipping transcription")
+            tracker.update(80, "Transcription found in cache...")
+        else:
+            def report_transcription_progress(completed, total):
+                if total:
+                    tracker.update(45 + (completed / total) * 35, f"Transcribed {completed} of {total} chunks")
+                else:
+                    tracker.set_step(f"Transcribed {completed} chunks, decoding the rest of the audio...")
+
+            tracker.update(45, "Transcribing audio...")
+            # With the streaming pipeline, the download and the decoding run during this stage
+            with time_stage('transcribe'):
+                results, total_transcription_time = Transcribe_Chunks_Concurrently(
+                    client, chunks, language, progress_callback=report_transcription_progress, journal=journal)
+            logger.info(f"Transcribed {len(results)} chunks with {total_transcription_time:.2f}s of cumulated API time")
+
+            tracker.update(80, "Merging transcriptions...")
+            with time_stage('merge'):
+                final_result = merge_transcriptions(results)
+
+            if transcription_cache is not None:
+                if isinstance(chunks, DigestingChunks):
+                    cache_keys.append(make_cache_key('audio', chunks.hexdigest(), language))
+                for cache_key in cache_keys:
+                    transcription_cache.put(cache_key, final_result)
+            if journal is not None:
+                journal.clear()
+        
+        tracker.update(90, "Generating files...")
+        with time_stage('subtitles'):
+            subtitles = render_subtitles(final_result['segments'], logger=logger)
+        with time_stage('upload'):
+            txt_path, docx_path, subtitle_paths = save_transcription(final_result['text'], timestamped_filename, subtitles, logger)
+        
+        # Save the response in the result store, where any worker can fetch it
+        result_store.put(TRANSCRIPTION_RESULT, timestamped_filename, {
+            'success': True,
+            'filename': filename,
+            'transcription': final_result['text'],
+            'txt': os.path.basename(txt_path),
+            'word_doc': os.path.basename(docx_path),
+            'srt': os.path.basename(subtitle_paths['srt']) if 'srt' in subtitle_paths else None,
+            'vtt': os.path.basename(subtitle_paths['vtt']) if 'vtt' in subtitle_paths else None,
+            'subtitles_json': os.path.basename(subtitle_paths['json']) if 'json' in subtitle_paths else None,
+            'timestamp': time.time()
+        })
+        # Delete audio_files from s3 once the result is stored, a retry needs them until then
+        delete_file_from_s3(file_path, logger)
+        # Report completion once the result can be fetched
+        tracker.update(100, "Transcription complete !")
+
+            
+    except Exception as e:
+        job = current_job()
+        if job is None or job.is_last_attempt() or isinstance(e, JobNotRetryable):
+            tracker.fail(f"transcription failed: {str(e)}")
+        else:
+            tracker.set_step(f"Attempt {job.attempt} failed, retrying: {str(e)}")
+        logger.error(f"Error during transcription of {filename}: {e}")
+        raise
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()  # stops the decoder and the download of a streamed job that failed
+        if source_stream is not None:
+            source_stream.close()
+        # Clean up the files of this job left in VIDEO_FOLDER, other jobs may still be using theirs
+        for leftover_path in (local_file_path, local_processed_file_path):
+            if leftover_path and os.path.exists(leftover_path):
+                try:
+                    os.remove(leftover_path)
+                    logger.info(f"Deleted leftover file: {leftover_path}")
+                except Exception as cleanup_error:
+                    logger.error(f"Failed to delete leftover file {leftover_path}: {cleanup_error}")
+
+@app.route('/api/jobs', methods=['GET'])
+def get_jobs_stats():
+    """Job queue depth and backlog"""
+    return jsonify(job_manager.stats()), 200
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """State of a transcription job"""
+    job = job_manager.get_status(job_id)
+    if not job:
+        return jsonify({'error': 'No job found for the provided id'}), 404
+    return jsonify(job), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics: stage timings, provider requests, bytes moved and job queue"""
+    content, content_type = render_metrics()
+    return Response(content, mimetype=content_type)
+
+@app.route('/api/health/live', methods=['GET'])
+def liveness():
+    """Liveness probe: the process serves requests and its job workers are running"""
+    if not job_manager.is_alive():
+        return jsonify({'status': 'unhealthy', 'details': 'A job worker thread died'}), 500
+    return jsonify({'status': 'alive'}), 200
+
+@app.route('/api/health/ready', methods=['GET'])
+def readiness():
+    """Readiness probe: new transcriptions can be accepted"""
+    if job_manager.is_draining():
+        return jsonify({'status': 'draining'}), 503
+    if job_manager.is_full():
+        return jsonify({'status': 'busy', 'queue': job_manager.stats()}), 503
+    return jsonify({'status': 'ready'}), 200
 
 
 @app.route('/api/fetch', methods=['POST'])
 def fetch_transcription():
-    """Fetch transcription result"""
-    global transcription_responses
+    """Fetch transcription result, waiting up to `wait` seconds for the job to finish"""
     try:
         data = request.get_json()
         timestamped_filename = data.get('timestamped_filename')
 
         if not timestamped_filename:
             return jsonify({'error': 'No timestamped_filename provided'}), 400
-
-        # Retrieve and delete the response from the global dictionary
-        response = transcription_responses.pop(timestamped_filename, None)
+        try:
+            wait = min(max(float(data.get('wait', request.args.get('wait', 0))), 0), Config.FETCH_MAX_WAIT)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'wait must be a number of seconds'}), 400
+
+        # Retrieve and delete the response from the result store
+        response = result_store.pop(TRANSCRIPTION_RESULT, timestamped_filename)
+        if not response and wait > 0:
+            # The job id is the timestamped filename, its result is stored before it finishes
+            job = job_manager.wait_for(timestamped_filename, wait)
+            response = result_store.pop(TRANSCRIPTION_RESULT, timestamped_filename)
+            if not response and job is not None:
+                return jsonify({'error': 'No transcription found for the provided filename', 'job': job}), 404
 
         if not response:
             return jsonify({'error': 'No transcription found for the provided filename'}), 404
@@ -402,6 +574,9 @@ def fetch_transcription():
 def download(filename):
     """Download document"""
     try:
+        if filename.endswith('.docx') and not ensure_docx(filename, logger):
+            return jsonify({'error': 'Download failed', 'details': 'Transcription not found'}), 404
+        
         # Generate presigned URL for the file
         logger.info(f"Trying to generate presigned URL for download: {filename}")
         presigned_url = generate_presigned_url_GET(filename, expires_in=60)
@@ -1,30 +1,56 @@
 import logging
 from config import Config
-from botocore.config import Config as botocore_config
-import boto3
-from botocore.exceptions import ClientError
+from src.metrics import BYTES_TRANSFERRED, count_bytes
 from datetime import datetime, timezone
 import os
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
 # ********************************************* Clients *********************************************
+# One client per process: boto3 clients are thread-safe and keep their connection pool between calls
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
 def initialize_s3client(logger = logger):
+    # boto3 takes a while to import, only load it when S3 is first used
+    import boto3
+    from botocore.config import Config as botocore_config
     s3_client = boto3.client(
     's3',
     aws_access_key_id=Config.AWS_ACCESS_KEY_ID,
     aws_secret_access_key=Config.AWS_SECRET_ACESS_KEY,
     region_name= Config.AWS_REGION,
-    config=botocore_config(signature_version='s3v4')
+    config=botocore_config(
+        signature_version='s3v4',
+        max_pool_connections=Config.S3_MAX_POOL_CONNECTIONS,
+        retries={'mode': Config.S3_RETRY_MODE, 'max_attempts': Config.S3_MAX_ATTEMPTS},
+        connect_timeout=Config.S3_CONNECT_TIMEOUT,
+        read_timeout=Config.S3_READ_TIMEOUT
+    )
     )
     logger.info("S3 client initialized")
     return s3_client
 
+def get_s3_client(logger = logger):
+    """ Return the S3 client shared by the whole process, creating it on first use """
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                _s3_client = initialize_s3client(logger)
+    return _s3_client
+
+def _is_not_found(error):
+    """True when a botocore ClientError reports a missing object."""
+    return (getattr(error, 'response', None) or {}).get('Error', {}).get('Code') in ('404', 'NoSuchKey')
+
 # ********************************************* Look for files *********************************************
 def list_files_in_s3(logger = logger):
     """ List all files in S3 bucket """
     try:
-        s3_client = initialize_s3client(logger)
+        s3_client = get_s3_client(logger)
         response = s3_client.list_objects_v2(
             Bucket=Config.BUCKET_NAME
         )
@@ -51,11 +77,11 @@ def get_all_fileNames_in_s3(logger = logger):
         logger.error(f"Error getting file names from S3: {e}")
         return None
 
-def check_file_exists(file_name, file_size=None, s3_client = initialize_s3client(), logger = logger):
+def check_file_exists(file_name, file_size=None, s3_client = None, logger = logger):
     """Check if a file already exist by checking the file name and size in the S3 bucker.
 
     Args:
-        s3_client (boto3 client): client to interact with S3
+        s3_client (boto3 client): client to interact with S3, the shared client by default
         file_name (str) : name of the file to check
         file_size (int) : size of the file to check
         
@@ -64,6 +90,7 @@ def check_file_exists(file_name, file_size=None, s3_client = initialize_s3client
         file size matches ? true : false
     """
     try:
+        s3_client = s3_client or get_s3_client(logger)
         logger.info(f"Checking if file exists in S3: {file_name}")
         response = s3_client.head_object(Bucket=Config.BUCKET_NAME, Key=file_name)
         
@@ -78,19 +105,39 @@ def check_file_exists(file_name, file_size=None, s3_client = initialize_s3client
         else:
             logger.info(f"File does not exists in S3: {file_name}")
             return False, False
-    except ClientError as e:
-        if e.response['Error']['Code'] == '404':
+    except Exception as e:
+        if _is_not_found(e):
             logger.info(f"File not found in S3: {file_name}")
             return False, False
         else:
             raise e
 
+def object_exists(file_name, logger = logger):
+    """ Return True if an object exists in the S3 bucket, whatever its size """
+    try:
+        get_s3_client(logger).head_object(Bucket=Config.BUCKET_NAME, Key=file_name)
+        return True
+    except Exception as e:
+        if _is_not_found(e):
+            return False
+        raise e
+
+def get_object_fingerprint(file_name, logger = logger):
+    """ Return a fingerprint of an S3 object built from its ETag and size, None if it cannot be read """
+    try:
+        response = get_s3_client(logger).head_object(Bucket=Config.BUCKET_NAME, Key=file_name)
+        etag = response['ETag'].strip('"')
+        return f"{etag}-{response['ContentLength']}"
+    except Exception as e:
+        logger.error(f"Error getting fingerprint of {file_name} from S3: {e}")
+        return None
+
 # ********************************************* open / download files *********************************************
 
 def open_from_s3(file_name, logger = logger):
     """ Open file from S3 """
     try:
-        s3_client = initialize_s3client(logger)
+        s3_client = get_s3_client(logger)
         object = s3_client.get_object(
             Bucket=Config.BUCKET_NAME,
             Key=file_name
@@ -98,17 +145,40 @@ def open_from_s3(file_name, logger = logger):
         logger.info(f"File opened from S3: {file_name}")
         file_type = file_name.split('.')[-1]
         content = object['Body'].read()
+        count_bytes('s3_download', content)
         return content, file_type
     except Exception as e:
         logger.error(f"Error opening file from S3: {e}")
         return None
 
+def open_stream_from_s3(file_name, logger = logger):
+    """ Open file from S3 as a stream, without reading its content
+
+    Returns:
+        StreamingBody: body of the object, to be read block by block and closed by the caller
+        str: file type (extension)
+    """
+    try:
+        s3_client = get_s3_client(logger)
+        object = s3_client.get_object(
+            Bucket=Config.BUCKET_NAME,
+            Key=file_name
+        )
+        logger.info(f"File stream opened from S3: {file_name} ({object.get('ContentLength')} bytes)")
+        file_type = file_name.split('.')[-1]
+        BYTES_TRANSFERRED.labels(transfer='s3_download').inc(object.get('ContentLength') or 0)
+        return object['Body'], file_type
+    except Exception as e:
+        logger.error(f"Error opening file stream from S3: {e}")
+        return None
+
 def download_from_s3(file_name, logger = logger):
     local_path=os.path.join(Config.VIDEO_FOLDER,file_name)
     try:
-        s3_client = initialize_s3client(logger)
+        s3_client = get_s3_client(logger)
         s3_client.download_file(Config.BUCKET_NAME, file_name, local_path)
         logger.info(f"File downloaded from S3: {file_name}")
+        BYTES_TRANSFERRED.labels(transfer='s3_download').inc(os.path.getsize(local_path))
         return local_path
     except Exception as e:
         logger.error(f"Error downloading file from S3: {e}")
@@ -116,19 +186,21 @@ def download_from_s3(file_name, logger = logger):
     
 # ********************************************* upload / delete files *********************************************
 
-def upload_to_s3(file_content, file_path, file_size = None, logger = logger):
+def upload_to_s3(file_content, file_path, file_size = None, logger = logger, check_exists = True, content_type = None):
     """ Upload file_content to S3 with a given file_name
     
     args:
         file_content (bytes): binary content of the file
         file_path (str): location to save the file in the s3 bucket
         file_size (int): size of the file
+        check_exists (bool): look for an existing file first (HEAD request), unneeded for a freshly timestamped key
+        content_type (str): Content-Type of the object
     
     """
     try:
-        s3_client = initialize_s3client(logger)
+        s3_client = get_s3_client(logger)
         
-        fileNameExists, FileSizeMatch = check_file_exists(file_path, file_size, s3_client)
+        fileNameExists, FileSizeMatch = check_file_exists(file_path, file_size, s3_client) if check_exists else (False, False)
         if(fileNameExists):
             if(FileSizeMatch):
                 logger.info(f"File already exists in S3: {file_path}")
@@ -143,11 +215,11 @@ def upload_to_s3(file_content, file_path, file_size = None, logger = logger):
                 file_path = "/".join(file_path)
                 logger.info(f"New file path: {file_path}")
         
-        response = s3_client.put_object(
-            Bucket=Config.BUCKET_NAME,
-            Key=file_path,
-            Body=file_content
-        )
+        put_params = {'Bucket': Config.BUCKET_NAME, 'Key': file_path, 'Body': file_content}
+        if content_type:
+            put_params['ContentType'] = content_type
+        response = s3_client.put_object(**put_params)
+        count_bytes('s3_upload', file_content)
         
         logger.info(f"File uploaded to S3: {file_path}")
         return response
@@ -158,7 +230,7 @@ def upload_to_s3(file_content, file_path, file_size = None, logger = logger):
 def delete_file_from_s3(file_name, logger = logger):
     """ Delete file from S3 """
     try:
-        s3_client = initialize_s3client(logger)
+        s3_client = get_s3_client(logger)
         response = s3_client.delete_object(
             Bucket=Config.BUCKET_NAME,
             Key=file_name
@@ -171,20 +243,88 @@ def delete_file_from_s3(file_name, logger = logger):
 
 
 
+S3_DELETE_BATCH_SIZE = 1000 # maximum number of keys of a delete_objects request
+
+def retention_rules(age_limit = Config.AGE_LIMIT):
+    """Return the {prefix: max age in seconds} of the files deleted by the sweeper.
+
+    The transcription cache is not in the rules, it expires its own entries.
+    """
+    rules = {
+        "": age_limit * 60, # files saved at the root of the bucket
+        Config.S3_UPLOAD_DIR: age_limit * 60,
+        Config.S3_TRANSCRIPT_DIR: age_limit * 60,
+        # Journals of running jobs are kept longer than the uploads and transcripts
+        Config.S3_JOURNAL_DIR: Config.CHUNK_JOURNAL_TTL,
+    }
+    return rules
+
+def delete_files_from_s3(file_names, logger = logger):
+    """ Delete files from S3 with one delete_objects request per batch of 1000 keys, returns the number deleted """
+    s3_client = get_s3_client(logger)
+    deleted = 0
+    for start in range(0, len(file_names), S3_DELETE_BATCH_SIZE):
+        batch = file_names[start:start + S3_DELETE_BATCH_SIZE]
+        response = s3_client.delete_objects(
+            Bucket=Config.BUCKET_NAME,
+            Delete={'Objects': [{'Key': file_name} for file_name in batch], 'Quiet': True}
+        )
+        for error in response.get('Errors', []):
+            logger.error(f"Error deleting file from S3: {error.get('Key')}: {error.get('Message')}")
+        deleted += len(batch) - len(response.get('Errors', []))
+    return deleted
+
+def _list_files_to_sweep(paginator, excluded):
+    """ Yield the files of the bucket page by page, each file once, without listing the excluded prefixes
+
+    The root is listed with a delimiter, which returns its own files and its directories,
+    then each directory that is not excluded is listed in full.
+    """
+    directories = []
+    for page in paginator.paginate(Bucket=Config.BUCKET_NAME, Delimiter='/'):
+        directories += [common_prefix['Prefix'] for common_prefix in page.get('CommonPrefixes', [])]
+        yield page.get('Contents', [])
+    for directory in directories:
+        if any(directory.startswith(excluded_prefix) for excluded_prefix in excluded):
+            continue
+        for page in paginator.paginate(Bucket=Config.BUCKET_NAME, Prefix=directory):
+            yield page.get('Contents', [])
+
 def Delete_Old_Files_From_S3(age_limit = Config.AGE_LIMIT, logger = logger):
-    """ Access S3 bucket and delete files older than age_limit """
+    """ Access S3 bucket and delete files older than their retention
+
+    The bucket is listed once, page by page, and the expired files of each page are deleted
+    in a single batch. A file gets the retention of the most specific prefix it falls under,
+    and the transcription cache is neither listed nor deleted here.
+
+    returns:
+        number of files deleted, None on error
+    """
     try:
+        start_time = time.time()
         now = datetime.now(timezone.utc)  # Use UTC time
-        files = list_files_in_s3(logger)
-        if files is None:
-            return None
-        for file in files:
-            file_name = file['Key']
-            file_age = now - file['LastModified']
-            if file_age.total_seconds() > age_limit * 60:
-                logger.info(f"File deleted: {file_name} with an age of: {file_age}")
-                delete_file_from_s3(file_name, logger)
-        logger.info("Old files deleted from S3")
+        rules = retention_rules(age_limit)
+        excluded = [Config.S3_CACHE_DIR]
+        s3_client = get_s3_client(logger)
+        paginator = s3_client.get_paginator('list_objects_v2')
+        scanned = 0
+        deleted = 0
+        for files in _list_files_to_sweep(paginator, excluded):
+            expired = []
+            for file in files:
+                file_name = file['Key']
+                scanned += 1
+                if any(file_name.startswith(excluded_prefix) for excluded_prefix in excluded):
+                    continue
+                prefix = max((rule for rule in rules if file_name.startswith(rule)), key=len, default=None)
+                if prefix is None:
+                    continue  # no retention rule
+                if (now - file['LastModified']).total_seconds() > rules[prefix]:
+                    expired.append(file_name)
+            if expired:
+                deleted += delete_files_from_s3(expired, logger)
+        logger.info(f"Old files deleted from S3: {deleted} of {scanned} files in {time.time() - start_time:.2f}s")
+        return deleted
     except Exception as e:
         logger.error(f"Error deleting old files from S3: {e}")
         return None
@@ -200,7 +340,7 @@ def generate_presigned_url_GET(file_path, expires_in = 60, logger = logger):
     :return: The presigned URL.
     """
     try:
-        s3_client = initialize_s3client(logger)
+        s3_client = get_s3_client(logger)
         bucket_name = Config.BUCKET_NAME
         key = file_path
         parameters = {"Bucket": bucket_name, "Key": key}
@@ -210,7 +350,7 @@ def generate_presigned_url_GET(file_path, expires_in = 60, logger = logger):
             ClientMethod=client_method, Params=parameters, ExpiresIn=expires_in
         )
         
-    except ClientError:
+    except Exception:
         logger.exception("Couldn't get a presigned GET URL for client")
         raise
     return url
@@ -224,7 +364,7 @@ def generate_presigned_url_POST(file_path, file_size = None, expires_in = 60, lo
     :return: The presigned URL.
     """
     try:
-        s3_client = initialize_s3client(logger)
+        s3_client = get_s3_client(logger)
         bucket_name = Config.BUCKET_NAME
         
         logger.info("checking if file exists in S3")
@@ -247,7 +387,7 @@ def generate_presigned_url_POST(file_path, file_size = None, expires_in = 60, lo
         response = s3_client.generate_presigned_post(
             Bucket = bucket_name, Key = key, ExpiresIn=expires_in
         )
-    except ClientError:
+    except Exception:
         logger.exception("Couldn't get a presigned POST URL for client")
         raise
     return response
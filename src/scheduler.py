@@ -0,0 +1,82 @@
+import logging
+import os
+import threading
+import time
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Lock file held by this process once it is the scheduler of the server
+_leadership_fd = None
+
+def acquire_leadership(lock_file=Config.SCHEDULER_LOCK_FILE, logger=logger):
+    """Return True if this process is the one running the periodic tasks among the server workers.
+
+    The first worker to take the lock keeps it until it exits, then the worker started to
+    replace it takes it over.
+    """
+    global _leadership_fd
+    if _leadership_fd is not None:
+        return True
+    try:
+        import fcntl
+    except ImportError:
+        return True  # no other worker on platforms without fcntl (development on Windows)
+    fd = os.open(lock_file, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    _leadership_fd = fd
+    logger.info(f"Process {os.getpid()} runs the periodic tasks")
+    return True
+
+
+class PeriodicTask:
+    """Run a function every interval seconds on a dedicated daemon thread.
+
+    Runs never overlap: the next one is scheduled interval seconds after the previous one
+    started, or right after it ended if it took longer. Errors are logged and do not stop
+    the schedule.
+
+    Args:
+        func (callable): function called without arguments.
+        interval (float): seconds between two runs.
+        name (str): name of the thread, used in logs.
+        run_at_start (bool): run once as soon as the task is started.
+    """
+
+    def __init__(self, func, interval, name, run_at_start=True, logger=logger):
+        self.func = func
+        self.interval = interval
+        self.name = name
+        self.run_at_start = run_at_start
+        self.logger = logger
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the schedule, once."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+            self._thread.start()
+        self.logger.info(f"Scheduled {self.name} every {self.interval}s")
+
+    def stop(self, timeout=None):
+        """Stop the schedule, waiting up to timeout seconds for a running run to end."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _loop(self):
+        next_run = time.monotonic() if self.run_at_start else time.monotonic() + self.interval
+        while not self._stop.wait(max(0, next_run - time.monotonic())):
+            next_run = time.monotonic() + self.interval
+            try:
+                self.func()
+            except Exception as e:
+                self.logger.error(f"{self.name} failed: {e}")
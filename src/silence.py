@@ -0,0 +1,67 @@
+import numpy as np
+from config import Config
+
+# Energy profile resolution
+FRAME_SECONDS = 0.02  # 20 ms frames
+
+def frame_energies(pcm, sample_rate = 16000):
+    """Mean energy of each frame of 16-bit mono PCM.
+
+    Args:
+        pcm (bytes or np.ndarray): 16-bit mono samples, a trailing partial frame is ignored.
+        sample_rate (int): sample rate of the PCM.
+
+    Returns:
+        np.ndarray: one float32 energy per FRAME_SECONDS frame.
+    """
+    if isinstance(pcm, (bytes, bytearray, memoryview)):
+        samples = np.frombuffer(pcm, dtype=np.int16)
+    else:
+        samples = np.asarray(pcm, dtype=np.int16)
+    frame_size = int(sample_rate * FRAME_SECONDS)
+    frame_count = len(samples) // frame_size
+    frames = samples[:frame_count * frame_size].astype(np.float32).reshape(frame_count, frame_size)
+    return np.einsum('ij,ij->i', frames, frames) / frame_size
+
+def find_quietest_frame(energies, start_frame, end_frame, min_silence = Config.SILENCE_MIN_DURATION):
+    """Return the frame at the centre of the quietest min_silence window between start_frame and end_frame.
+
+    Ties go to the latest window, so chunks stay as close as possible to their target length.
+    """
+    window = max(1, int(round(min_silence / FRAME_SECONDS)))
+    energies = energies[start_frame:end_frame]
+    if len(energies) < window:
+        return end_frame
+    # Moving average of the energy over the window, for every window position at once
+    cumulated = np.concatenate(([0.0], np.cumsum(energies, dtype=np.float64)))
+    smoothed = cumulated[window:] - cumulated[:-window]
+    latest_minimum = len(smoothed) - 1 - int(np.argmin(smoothed[::-1]))
+    return start_frame + latest_minimum + window // 2
+
+def plan_silence_boundaries(energies, duration, chunk_length = 600, overlap = Config.SILENCE_CHUNK_OVERLAP,
+                            search_window = Config.SILENCE_SEARCH_WINDOW):
+    """Return the (start, end) times in seconds of chunks cut inside silences.
+
+    Each chunk ends at the quietest point of the search_window seconds before its target
+    length, and the next one starts overlap seconds before that point.
+
+    Args:
+        energies (np.ndarray): energy profile of the whole audio, from frame_energies.
+        duration (float): duration of the audio in seconds.
+        chunk_length (float): target (and maximum) length of a chunk in seconds.
+        overlap (float): overlap between consecutive chunks in seconds.
+        search_window (float): seconds before the target end searched for a silence.
+    """
+    boundaries = []
+    start = 0.0
+    while True:
+        target = start + chunk_length
+        if target >= duration:
+            boundaries.append((start, duration))
+            return boundaries
+        # Never cut before the overlap, so every chunk brings new audio
+        search_start = max(start + overlap + FRAME_SECONDS, target - search_window)
+        cut_frame = find_quietest_frame(energies, int(search_start / FRAME_SECONDS), int(target / FRAME_SECONDS))
+        cut = round(cut_frame * FRAME_SECONDS, 3)
+        boundaries.append((start, cut))
+        start = cut - overlap
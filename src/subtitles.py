@@ -0,0 +1,125 @@
+import io
+import json
+import logging
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SUBTITLE_CONTENT_TYPES = {
+    'srt': 'application/x-subrip',
+    'vtt': 'text/vtt',
+    'json': 'application/json',
+}
+
+def format_timestamp(seconds, separator=','):
+    """Format seconds as HH:MM:SS,mmm (SRT) or HH:MM:SS.mmm (WebVTT)."""
+    return f"{int(seconds // 3600):02}:{int((seconds % 3600) // 60):02}:{int(seconds % 60):02}{separator}{int((seconds % 1) * 1000):03}"
+
+def escape_vtt_text(text):
+    """Escape a WebVTT cue payload, where & and < start markup and "-->" may not appear."""
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')  # "-->" becomes "--&gt;"
+
+def iter_cues(segments):
+    """Yield the (id, start, end, text) cues of transcription segments.
+
+    Segments of chunks transcribed separately restart at id 0 and time 0, such restarts are
+    shifted after the previous cue so ids and times keep increasing.
+    """
+    # harmonizers because of the chunks
+    last_id = 0
+    last_end_time = 0.0
+    time_cursor = 0.0
+    id_cursor = 1
+
+    for segment in segments:
+        # Harmonize the start_time, end_time, and id if they go back to 0
+        if segment['id'] == 0 and segment['start'] == 0:
+            id_cursor += last_id
+            time_cursor += last_end_time
+
+        start_time = segment['start'] + time_cursor
+        end_time = segment['end'] + time_cursor
+        id = segment['id'] + id_cursor
+        yield id, start_time, end_time, segment['text'].lstrip()  # Remove leading space
+
+        last_id = id
+        last_end_time = end_time
+
+# ********************************************* Writers *********************************************
+class SRTWriter:
+    def __init__(self, out):
+        self.out = out
+
+    def write_cue(self, id, start, end, text):
+        self.out.write(f"{id}\n{format_timestamp(start)} --> {format_timestamp(end)}\n{text}\n\n")
+
+    def close(self):
+        pass
+
+
+class VTTWriter:
+    def __init__(self, out):
+        self.out = out
+        out.write("WEBVTT\n\n")
+
+    def write_cue(self, id, start, end, text):
+        self.out.write(f"{id}\n{format_timestamp(start, '.')} --> {format_timestamp(end, '.')}\n{escape_vtt_text(text)}\n\n")
+
+    def close(self):
+        pass
+
+
+class JSONWriter:
+    """Writes {"segments": [...]} one cue at a time, never holding the whole document."""
+
+    def __init__(self, out):
+        self.out = out
+        self.first = True
+        out.write('{"segments": [')
+
+    def write_cue(self, id, start, end, text):
+        if not self.first:
+            self.out.write(', ')
+        self.first = False
+        self.out.write(json.dumps({'id': id, 'start': start, 'end': end, 'text': text}, ensure_ascii=False))
+
+    def close(self):
+        self.out.write(']}')
+
+
+SUBTITLE_WRITERS = {
+    'srt': SRTWriter,
+    'vtt': VTTWriter,
+    'json': JSONWriter,
+}
+
+def write_subtitles(segments, outputs):
+    """Render segments into several subtitle formats in a single pass.
+
+    Args:
+        segments (iterable): merged transcription segments.
+        outputs (dict): text streams by format ('srt', 'vtt' or 'json').
+    """
+    writers = [SUBTITLE_WRITERS[subtitle_format](out) for subtitle_format, out in outputs.items()]
+    for cue in iter_cues(segments):
+        for writer in writers:
+            writer.write_cue(*cue)
+    for writer in writers:
+        writer.close()
+
+def render_subtitles(segments, formats=Config.SUBTITLE_FORMATS, logger=logger):
+    """Render segments into in-memory UTF-8 files, ready to be uploaded.
+
+    Returns:
+        dict: io.BytesIO by format, rewound.
+    """
+    logger.info(f"Generating {', '.join(formats)} subtitles")
+    buffers = {subtitle_format: io.BytesIO() for subtitle_format in formats}
+    outputs = {subtitle_format: io.TextIOWrapper(buffer, encoding='utf-8', newline='\n', write_through=False)
+               for subtitle_format, buffer in buffers.items()}
+    write_subtitles(segments, outputs)
+    for out in outputs.values():
+        out.detach()  # flushes, and keeps the buffer open
+    for buffer in buffers.values():
+        buffer.seek(0)
+    return buffers
@@ -0,0 +1,222 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from config import Config
+from src.s3Bucket import get_s3_client
+
+logger = logging.getLogger(__name__)
+
+# Bump when a change to the pipeline (splitting, merging...) changes the merged segments
+CACHE_VERSION = 3
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# ********************************************* Keys *********************************************
+def make_cache_key(kind, digest, language, model = Config.GROQ_MODEL, merge_strategy = Config.MERGE_STRATEGY):
+    """Build the cache key of a transcription.
+
+    Args:
+        kind (str): what the digest was computed on, 'audio' for the preprocessed 16kHz FLAC,
+            'source' for the fingerprint of the uploaded S3 object.
+        digest (str): hash of the audio or fingerprint of the source.
+        language (str): language requested for the transcription.
+        model (str): transcription model.
+        merge_strategy (str): how the chunks are merged.
+    """
+    key = f"v{CACHE_VERSION}|{kind}|{digest}|{language}|{model}|{merge_strategy}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def hash_bytes(data):
+    """SHA-256 of in-memory audio."""
+    return hashlib.sha256(data).hexdigest()
+
+def hash_file(file_path):
+    """SHA-256 of a file, read block by block."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DigestingChunks:
+    """Wrap an iterable of (chunk, offset) pairs and hash the FLAC chunks as they go through.
+
+    Used when the chunks are streamed, since the preprocessed audio never exists as a whole.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._digest = hashlib.sha256()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        chunk, offset = next(self._chunks)
+        self._digest.update(chunk.getvalue())
+        return chunk, offset
+
+    def close(self):
+        if hasattr(self._chunks, 'close'):
+            self._chunks.close()
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+# ********************************************* Backends *********************************************
+class LocalDiskCache:
+    """Transcription cache stored as JSON files in a local directory.
+
+    Entries expire after ttl seconds. When the directory grows over max_bytes, the least
+    recently used entries are evicted first.
+    """
+
+    def __init__(self, directory = Config.TRANSCRIPTION_CACHE_DIR, ttl = Config.TRANSCRIPTION_CACHE_TTL,
+                 max_bytes = Config.TRANSCRIPTION_CACHE_MAX_BYTES, logger = logger):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.logger = logger
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+            os.utime(path)  # mark as recently used
+            return value
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            self.logger.error(f"Error reading transcription cache entry {key}: {e}")
+            return None
+
+    def put(self, key, value):
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(value, f, default=str)
+            os.replace(temp_path, path)
+            self.evict()
+        except Exception as e:
+            self.logger.error(f"Error writing transcription cache entry {key}: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def evict(self):
+        """Delete expired entries, then the least recently used ones until under max_bytes."""
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                stat = entry.stat()
+                if now - stat.st_mtime > self.ttl:
+                    os.remove(entry.path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            except FileNotFoundError:
+                continue  # evicted by another thread
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+
+class S3Cache:
+    """Transcription cache stored as JSON objects under a prefix of the S3 bucket.
+
+    Entries expire after ttl seconds. When the prefix grows over max_bytes, the oldest
+    entries are evicted first.
+    """
+
+    def __init__(self, prefix = Config.S3_CACHE_DIR, ttl = Config.TRANSCRIPTION_CACHE_TTL,
+                 max_bytes = Config.TRANSCRIPTION_CACHE_MAX_BYTES, logger = logger):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.logger = logger
+
+    def _key(self, key):
+        return f"{self.prefix}{key}.json"
+
+    def get(self, key):
+        s3_client = get_s3_client(self.logger)
+        try:
+            object = s3_client.get_object(Bucket=Config.BUCKET_NAME, Key=self._key(key))
+        except s3_client.exceptions.NoSuchKey:
+            return None
+        except Exception as e:
+            self.logger.error(f"Error reading transcription cache entry {key}: {e}")
+            return None
+        if time.time() - object['LastModified'].timestamp() > self.ttl:
+            object['Body'].close()
+            s3_client.delete_object(Bucket=Config.BUCKET_NAME, Key=self._key(key))
+            return None
+        return json.loads(object['Body'].read())
+
+    def put(self, key, value):
+        try:
+            get_s3_client(self.logger).put_object(
+                Bucket=Config.BUCKET_NAME,
+                Key=self._key(key),
+                Body=json.dumps(value, default=str).encode('utf-8'),
+                ContentType='application/json'
+            )
+            self.evict()
+        except Exception as e:
+            self.logger.error(f"Error writing transcription cache entry {key}: {e}")
+
+    def evict(self):
+        """Delete expired entries, then the oldest ones until under max_bytes."""
+        s3_client = get_s3_client(self.logger)
+        now = time.time()
+        entries = []
+        expired = []
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=Config.BUCKET_NAME, Prefix=self.prefix):
+            for object in page.get('Contents', []):
+                if now - object['LastModified'].timestamp() > self.ttl:
+                    expired.append(object['Key'])
+                else:
+                    entries.append((object['LastModified'], object['Size'], object['Key']))
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            expired.append(key)
+            total_bytes -= size
+        for start in range(0, len(expired), 1000):
+            s3_client.delete_objects(
+                Bucket=Config.BUCKET_NAME,
+                Delete={'Objects': [{'Key': key} for key in expired[start:start + 1000]], 'Quiet': True}
+            )
+
+
+def create_transcription_cache(backend = Config.TRANSCRIPTION_CACHE_BACKEND, logger = logger):
+    """Return the cache backend selected in the configuration, None when caching is disabled."""
+    if backend == "disk":
+        return LocalDiskCache(logger=logger)
+    if backend == "s3":
+        return S3Cache(logger=logger)
+    if backend != "none":
+        logger.error(f"Unknown transcription cache backend: {backend}, caching disabled")
+    return None
+
+transcription_cache = create_transcription_cache()
@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# The configuration is read from a private secrets cache instead of AWS Secrets Manager
+_secrets_dir = tempfile.mkdtemp(prefix='mcc-transcript-tests-')
+_secrets_file = os.path.join(_secrets_dir, 'secrets.json')
+with open(os.open(_secrets_file, os.O_WRONLY | os.O_CREAT, 0o600), 'w', encoding='utf-8') as f:
+    f.write('{"FRONTEND_PORT": "3000", "CLIENT_CHOICE": "2"}')
+os.environ.setdefault('SECRETS_CACHE_FILE', _secrets_file)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
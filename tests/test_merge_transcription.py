@@ -0,0 +1,67 @@
+import random
+import re
+import tracemalloc
+
+import pytest
+
+from src import merge_transcription
+from src.merge_transcription import find_longest_common_sequence
+
+
+def reference_longest_common_sequence(sequences):
+    """Shift-by-shift alignment the vectorized one replaced, kept as the reference."""
+    sequences = [[word for word in re.split(r'(\s+\w+)', seq) if word] for seq in sequences]
+    left_sequence = sequences[0]
+    left_length = len(left_sequence)
+    total_sequence = []
+    for right_sequence in sequences[1:]:
+        max_matching = 0.0
+        right_length = len(right_sequence)
+        max_indices = (left_length, left_length, 0, 0)
+        for i in range(1, left_length + right_length + 1):
+            eps = float(i) / 10000.0
+            left_start = max(0, left_length - i)
+            left_stop = min(left_length, left_length + right_length - i)
+            right_start = max(0, i - left_length)
+            right_stop = min(right_length, i)
+            matches = sum(a == b for a, b in zip(left_sequence[left_start:left_stop],
+                                                 right_sequence[right_start:right_stop]))
+            matching = matches / float(i) + eps
+            if matches > 1 and matching > max_matching:
+                max_matching = matching
+                max_indices = (left_start, left_stop, right_start, right_stop)
+        left_start, left_stop, right_start, right_stop = max_indices
+        total_sequence.extend(left_sequence[:(left_stop + left_start) // 2])
+        left_sequence = right_sequence[(right_stop + right_start) // 2:]
+        left_length = len(left_sequence)
+    total_sequence.extend(left_sequence)
+    return ''.join(total_sequence)
+
+def random_seam(rng):
+    vocabulary = ['the', 'a', 'budget', 'client', 'music', 'so', 'yes', 'launch', 'review', 'and']
+    words = [rng.choice(vocabulary[:rng.randint(2, len(vocabulary))]) for _ in range(rng.randint(0, 40))]
+    overlap = rng.randint(0, len(words))
+    left = ' ' + ' '.join(words)
+    right = ' ' + ' '.join(words[len(words) - overlap:] + [rng.choice(vocabulary) for _ in range(rng.randint(0, 20))])
+    return [left, right]
+
+
+@pytest.mark.parametrize('max_pairs', [merge_transcription.MAX_ALIGNMENT_PAIRS, 0])
+def test_alignment_matches_reference(monkeypatch, max_pairs):
+    # max_pairs 0 forces the shift-by-shift path used for highly repetitive seams
+    monkeypatch.setattr(merge_transcription, 'MAX_ALIGNMENT_PAIRS', max_pairs)
+    rng = random.Random(0)
+    for _ in range(3000 if max_pairs else 500):
+        seam = random_seam(rng)
+        assert find_longest_common_sequence(seam) == reference_longest_common_sequence(seam), seam
+
+def test_repeated_tokens_use_linear_memory():
+    seam = [' music' * 6000, ' music' * 6000 + ' hello there']  # e.g. a long stretch tagged as music
+    tracemalloc.start()
+    try:
+        merged = find_longest_common_sequence(seam)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < 50 * 1024 * 1024
+    assert merged.endswith(' hello there')
@@ -0,0 +1,57 @@
+import io
+import threading
+
+from src.process_audio import SourceSpool
+
+
+class SlowReadSource(io.BytesIO):
+    """Source that records when it has been read to the end."""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.exhausted = threading.Event()
+
+    def read(self, size=-1):
+        block = super().read(size)
+        if not block:
+            self.exhausted.set()
+        return block
+
+
+def test_spool_downloads_without_waiting_for_the_reader():
+    data = bytes(range(256)) * 20000  # 5 MB, several blocks
+    source = SlowReadSource(data)
+    spool = SourceSpool(source, max_memory=1024 * 1024)  # spooled to disk past 1 MB
+    # Nothing is read from the spool yet, the source is downloaded all the same
+    assert source.exhausted.wait(5)
+    read = bytearray()
+    while True:
+        block = spool.read(300000)
+        if not block:
+            break
+        read += block
+    assert bytes(read) == data
+    spool.close()
+
+def test_spool_reports_the_end_of_the_download():
+    done = threading.Event()
+    spool = SourceSpool(io.BytesIO(b'audio' * 1000), on_done=done.set)
+    assert done.wait(5)
+    spool.close()
+
+def test_spool_close_unblocks_the_reader():
+    writing = threading.Event()
+
+    class BlockingSource:
+        def read(self, size):
+            writing.wait(5)
+            return b''
+
+    spool = SourceSpool(BlockingSource())
+    result = []
+    reader = threading.Thread(target=lambda: result.append(spool.read(10)))
+    reader.start()
+    spool.close()
+    reader.join(5)
+    writing.set()
+    assert result == [b'']
@@ -0,0 +1,136 @@
+import threading
+import time
+
+import pytest
+
+from src.result_store import SQLiteStore, RedisStore, TRANSCRIPTION_RESULT
+
+
+class FakeRedis:
+    """In-memory stand-in for the subset of redis-py used by RedisStore."""
+
+    def __init__(self):
+        self.now = time.time
+        self._values = {}
+        self._lock = threading.RLock()  # re-entered by the commands of a pipeline
+
+    def set(self, key, value, ex=None):
+        assert ex is None or (isinstance(ex, int) and ex >= 1)  # what Redis accepts
+        with self._lock:
+            self._values[key] = (value.encode('utf-8'), None if ex is None else self.now() + ex)
+
+    def get(self, key):
+        with self._lock:
+            value, expires_at = self._values.get(key, (None, None))
+            if expires_at is not None and expires_at <= self.now():
+                del self._values[key]
+                return None
+            return value
+
+    def delete(self, key):
+        with self._lock:
+            return int(self._values.pop(key, None) is not None)
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    """MULTI/EXEC pipeline: the queued commands run without other clients in between."""
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def get(self, key):
+        self.commands.append(('get', key))
+
+    def delete(self, key):
+        self.commands.append(('delete', key))
+
+    def execute(self):
+        with self.client._lock:
+            return [getattr(self.client, name)(key) for name, key in self.commands]
+
+
+class Clock:
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def store(request, tmp_path):
+    if request.param == 'sqlite':
+        return SQLiteStore(str(tmp_path / 'results.sqlite3'), ttl=60)
+    return RedisStore(ttl=60, client=FakeRedis())
+
+@pytest.fixture
+def clock(monkeypatch, store):
+    """Time seen by the store, moved forward by the tests."""
+    clock = Clock()
+    monkeypatch.setattr('src.result_store.time.time', clock)
+    if isinstance(store, RedisStore):
+        store.client.now = clock
+    return clock
+
+
+def test_put_get_pop(store):
+    store.put(TRANSCRIPTION_RESULT, 'job', {'txt': 'a.txt', 'segments': [1, 2]})
+    assert store.get(TRANSCRIPTION_RESULT, 'job') == {'txt': 'a.txt', 'segments': [1, 2]}
+    assert store.get('job', 'job') is None  # namespaces are separate
+    assert store.pop(TRANSCRIPTION_RESULT, 'job') == {'txt': 'a.txt', 'segments': [1, 2]}
+    assert store.pop(TRANSCRIPTION_RESULT, 'job') is None
+    assert store.get(TRANSCRIPTION_RESULT, 'job') is None
+
+def test_put_replaces(store):
+    store.put(TRANSCRIPTION_RESULT, 'job', 1)
+    store.put(TRANSCRIPTION_RESULT, 'job', 2)
+    assert store.get(TRANSCRIPTION_RESULT, 'job') == 2
+
+def test_pop_is_atomic(store):
+    for attempt in range(5):
+        key = f'job-{attempt}'
+        store.put(TRANSCRIPTION_RESULT, key, {'attempt': attempt})
+        barrier = threading.Barrier(8)
+        popped = []
+
+        def pop():
+            barrier.wait()
+            popped.append(store.pop(TRANSCRIPTION_RESULT, key))
+
+        threads = [threading.Thread(target=pop) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert [value for value in popped if value is not None] == [{'attempt': attempt}]
+
+def test_entries_expire(store, clock):
+    store.put(TRANSCRIPTION_RESULT, 'short', 1, ttl=5)
+    store.put(TRANSCRIPTION_RESULT, 'default', 2)
+    clock.now += 10
+    assert store.get(TRANSCRIPTION_RESULT, 'short') is None
+    assert store.pop(TRANSCRIPTION_RESULT, 'short') is None
+    assert store.get(TRANSCRIPTION_RESULT, 'default') == 2
+    clock.now += 60
+    store.cleanup()
+    assert store.get(TRANSCRIPTION_RESULT, 'default') is None
+
+def test_sqlite_store_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / 'results.sqlite3')
+    SQLiteStore(path, ttl=60).put(TRANSCRIPTION_RESULT, 'job', 'done')
+    other_worker = SQLiteStore(path, ttl=60)
+    assert other_worker.pop(TRANSCRIPTION_RESULT, 'job') == 'done'
+    assert SQLiteStore(path, ttl=60).get(TRANSCRIPTION_RESULT, 'job') is None
+
+def test_sqlite_cleanup_deletes_expired_rows(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr('src.result_store.time.time', clock)
+    store = SQLiteStore(str(tmp_path / 'results.sqlite3'), ttl=60)
+    store.put(TRANSCRIPTION_RESULT, 'job', 1)
+    clock.now += 61
+    store.cleanup()
+    assert store._connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0] == 0
@@ -0,0 +1,10 @@
+from src.subtitles import render_subtitles
+
+
+def test_vtt_cue_payload_is_escaped():
+    segments = [{'id': 0, 'start': 0.0, 'end': 1.5, 'text': ' Tom & Jerry <laughs> --> end'}]
+    outputs = render_subtitles(segments, formats=['vtt', 'srt'])
+    vtt = outputs['vtt'].getvalue().decode('utf-8')
+    assert vtt == "WEBVTT\n\n1\n00:00:00.000 --> 00:00:01.500\nTom &amp; Jerry &lt;laughs&gt; --&gt; end\n\n"
+    # SRT cues are left as transcribed
+    assert "Tom & Jerry <laughs> --> end" in outputs['srt'].getvalue().decode('utf-8')
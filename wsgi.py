@@ -0,0 +1,19 @@
+"""WSGI entry point of the production server, see gunicorn.conf.py:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+from src.file_utils import schedule_cleanup
+from src.initiate import initialize_app
+from src.logger import setup_logger, log_rotation_task
+from src.scheduler import acquire_leadership
+from app import app
+
+initialize_app(app)
+# Every worker appends to the same log file
+logger = setup_logger(shared_file=True)
+# A single worker runs the periodic tasks and rotates the log file
+leader = acquire_leadership()
+schedule_cleanup(leader)
+if leader:
+    log_rotation_task.start()
+logger.info("Flask application loaded by the WSGI server")